@@ -4,30 +4,52 @@
 集中管理所有配置参数，包括 API 密钥、模型参数、URL 等。
 """
 
+import logging
 import os
-from typing import List, Optional
-from dotenv import load_dotenv
-
-# 加载环境变量
-load_dotenv()
+import sys
+from functools import cached_property, lru_cache
+from typing import Any, Dict, List, Optional
+from dotenv import dotenv_values
 
 # 设置 USER_AGENT 避免警告
 if not os.environ.get("USER_AGENT"):
     os.environ["USER_AGENT"] = "adaptive-rag-system/1.0"
 
 
-class Config:
+@lru_cache(maxsize=1)
+def _env_dict() -> dict:
+    """
+    解析 .env 文件
+    
+    结果在进程内缓存，.env 只会被读取和解析一次（即使文件为空）。
+    
+    返回:
+        .env 中的键值对
+    """
+    return dict(dotenv_values())
+
+
+class _Config:
     """
     配置管理类
     
     提供系统配置的集中管理。
-    所有配置项都可以通过环境变量覆盖。
+    依赖环境变量的配置项在首次访问时才读取并缓存，
+    请通过 get_config() 获取全局唯一实例。
     """
     
     # ===== API 密钥配置 =====
-    OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY", "")
-    COHERE_API_KEY: str = os.getenv("COHERE_API_KEY", "")
-    TAVILY_API_KEY: str = os.getenv("TAVILY_API_KEY", "")
+    @cached_property
+    def OPENAI_API_KEY(self) -> str:
+        return os.getenv("OPENAI_API_KEY", "")
+    
+    @cached_property
+    def COHERE_API_KEY(self) -> str:
+        return os.getenv("COHERE_API_KEY", "")
+    
+    @cached_property
+    def TAVILY_API_KEY(self) -> str:
+        return os.getenv("TAVILY_API_KEY", "")
     
     # LangSmith 配置（已禁用）
     # LANGCHAIN_TRACING_V2: bool = os.getenv("LANGCHAIN_TRACING_V2", "false").lower() == "true"
@@ -37,8 +59,10 @@ class Config:
     # ===== 模型配置 =====
     # 默认模型
     DEFAULT_LLM_MODEL: str = "gpt-5"
-    DEFAULT_GENERATION_MODEL: str = "gpt-5"
-    DEFAULT_REWRITE_MODEL: str = "gpt-5"
+    
+    # 路由和评分模型：只输出很短的结构化结果，使用更小更快的模型
+    GRADER_MODEL: str = "gpt-4o-mini"
+    GRADER_MAX_TOKENS: int = 64  # 足够容纳结构化输出的函数调用参数
     
     # 温度参数
     DEFAULT_TEMPERATURE: float = 0.0
@@ -50,10 +74,21 @@ class Config:
     # 文本分割参数
     CHUNK_SIZE: int = 500  # Token 数量
     CHUNK_OVERLAP: int = 0  # 重叠 Token 数量
+    EMBEDDING_BATCH_SIZE: int = 128  # 每次嵌入 API 请求包含的文档块数量
     
     # 检索参数
     RETRIEVAL_K: int = 4  # 默认检索文档数量
     
+    # HNSW 索引参数（集合创建时生效）
+    CHROMA_COLLECTION_METADATA: Dict[str, Any] = {
+        "hnsw:space": "cosine",
+        "hnsw:M": 32,
+        "hnsw:construction_ef": 200,
+    }
+    
+    # 传给 LLM 的文档上下文最大字符数
+    MAX_CONTEXT_CHARS: int = 12000
+    
     # ===== 默认文档源 =====
     DEFAULT_URLS: List[str] = [
         "https://lilianweng.github.io/posts/2023-06-23-agent/",
@@ -61,18 +96,59 @@ class Config:
         "https://lilianweng.github.io/posts/2023-10-25-adv-attack-llm/",
     ]
     
+    # ===== 路由配置 =====
+    # 各路由的原型问题，用于基于嵌入相似度的快速路由
+    ROUTE_PROTOTYPES: Dict[str, List[str]] = {
+        "vectorstore": [
+            "What are the types of agent memory?",
+            "How does task decomposition work for LLM agents?",
+            "What is chain-of-thought prompting?",
+            "What is prompt engineering?",
+            "What are adversarial attacks on large language models?",
+            "How do jailbreak prompts work?",
+        ],
+        "web_search": [
+            "What's the latest news about OpenAI?",
+            "Who won the game last night?",
+            "What is the weather today?",
+            "What happened in the stock market this week?",
+            "Who is expected to be drafted first in the NFL draft?",
+            "What are today's top headlines?",
+        ],
+    }
+    # 两个路由的相似度差距超过该值时直接采用嵌入路由，否则交给 LLM
+    ROUTER_EMBEDDING_MARGIN: float = 0.15
+    # LLM 路由置信度低于该值时，同时检索向量存储和网络搜索
+    ROUTER_CONFIDENCE_THRESHOLD: float = 0.7
+    
     # ===== 网络搜索配置 =====
     WEB_SEARCH_K: int = 3  # 网络搜索结果数量
     
     # ===== 工作流配置 =====
     MAX_ITERATIONS: int = 3  # 最大重试次数
+    MAX_CONCURRENCY: int = 8  # 并发 LLM 调用数量上限
+    LEXICAL_PREFILTER_THRESHOLD: float = 0.05  # 问题词与文档词的最低重叠比例，低于此值不再调用 LLM 评分
+    HALLUCINATION_EARLY_ABORT: bool = False  # 流式生成时发现文档中不存在的数字即提前终止（默认关闭）
+    HALLUCINATION_CHECK_INTERVAL: int = 20  # 流式生成时每隔多少个片段做一次幻觉快速检查
+    HALLUCINATION_MIN_ENTITIES: int = 3  # 至少出现多少个文档中不存在的数字才提前终止生成
+    UNVERIFIED_ANSWER_FALLBACK: str = "抱歉，多次尝试后仍未能生成可靠的答案。"  # 答案被提前终止且重写次数耗尽时返回
+    
+    # ===== 缓存配置 =====
+    CACHE_DIR: str = os.path.join(os.path.expanduser("~"), ".cache", "adaptive-rag")
+    LLM_CACHE_PATH: str = os.path.join(CACHE_DIR, "llm_cache.db")  # LLM 响应缓存（SQLite）
+    SEMANTIC_CACHE_THRESHOLD: float = 0.95  # 语义缓存命中所需的最低余弦相似度
+    DECISION_CACHE_SIZE: int = 1024  # 路由决策、问题重写缓存的最大条目数（LRU 淘汰）
     
     # ===== 调试配置 =====
-    DEBUG_MODE: bool = os.getenv("DEBUG_MODE", "false").lower() == "true"
-    VERBOSE: bool = os.getenv("VERBOSE", "true").lower() == "true"
+    @cached_property
+    def DEBUG_MODE(self) -> bool:
+        return os.getenv("DEBUG_MODE", "false").lower() == "true"
+    
+    @cached_property
+    def VERBOSE(self) -> bool:
+        return os.getenv("VERBOSE", "true").lower() == "true"
     
-    @classmethod
-    def validate(cls) -> bool:
+    def validate(self) -> bool:
         """
         验证配置是否有效
         
@@ -82,10 +158,10 @@ class Config:
         errors = []
         
         # 检查必需的 API 密钥
-        if not cls.OPENAI_API_KEY:
+        if not self.OPENAI_API_KEY:
             errors.append("OPENAI_API_KEY 未设置")
         
-        if not cls.TAVILY_API_KEY:
+        if not self.TAVILY_API_KEY:
             errors.append("TAVILY_API_KEY 未设置")
         
         # 如果有错误，打印并返回 False
@@ -97,65 +173,85 @@ class Config:
         
         return True
     
-    @classmethod
-    def print_config(cls):
+    def print_config(self):
         """
         打印当前配置（隐藏敏感信息）
         """
-        print("\n===== 当前配置 =====")
-        print(f"OpenAI API Key: {'已设置' if cls.OPENAI_API_KEY else '未设置'}")
-        print(f"Tavily API Key: {'已设置' if cls.TAVILY_API_KEY else '未设置'}")
-        print(f"Cohere API Key: {'已设置' if cls.COHERE_API_KEY else '未设置'}")
-        # print(f"LangSmith 追踪: {'启用' if cls.LANGCHAIN_TRACING_V2 else '禁用'}")
-        print(f"LangSmith 追踪: 已禁用")
-        print(f"默认 LLM 模型: {cls.DEFAULT_LLM_MODEL}")
-        print(f"块大小: {cls.CHUNK_SIZE} tokens")
-        print(f"检索文档数: {cls.RETRIEVAL_K}")
-        print(f"网络搜索结果数: {cls.WEB_SEARCH_K}")
-        print(f"调试模式: {'启用' if cls.DEBUG_MODE else '禁用'}")
-        print("==================\n")
-    
-    @classmethod
-    def setup_environment(cls):
+        lines = [
+            "",
+            "===== 当前配置 =====",
+            f"OpenAI API Key: {'已设置' if self.OPENAI_API_KEY else '未设置'}",
+            f"Tavily API Key: {'已设置' if self.TAVILY_API_KEY else '未设置'}",
+            f"Cohere API Key: {'已设置' if self.COHERE_API_KEY else '未设置'}",
+            # f"LangSmith 追踪: {'启用' if self.LANGCHAIN_TRACING_V2 else '禁用'}",
+            "LangSmith 追踪: 已禁用",
+            f"默认 LLM 模型: {self.DEFAULT_LLM_MODEL}",
+            f"评分模型: {self.GRADER_MODEL}",
+            f"块大小: {self.CHUNK_SIZE} tokens",
+            f"检索文档数: {self.RETRIEVAL_K}",
+            f"网络搜索结果数: {self.WEB_SEARCH_K}",
+            f"调试模式: {'启用' if self.DEBUG_MODE else '禁用'}",
+            "==================",
+            "",
+        ]
+        # 一次性写出，避免多次 print
+        sys.stdout.write("\n".join(lines) + "\n")
+    
+    def setup_environment(self):
         """
         设置环境变量
         
         用于初始化系统环境。
         """
-        # 设置 API 密钥到环境变量
-        if cls.OPENAI_API_KEY:
-            os.environ["OPENAI_API_KEY"] = cls.OPENAI_API_KEY
-        
-        if cls.COHERE_API_KEY:
-            os.environ["COHERE_API_KEY"] = cls.COHERE_API_KEY
-        
-        if cls.TAVILY_API_KEY:
-            os.environ["TAVILY_API_KEY"] = cls.TAVILY_API_KEY
+        # 设置 API 密钥到环境变量（值未变化时跳过）
+        for key, value in (
+            ("OPENAI_API_KEY", self.OPENAI_API_KEY),
+            ("COHERE_API_KEY", self.COHERE_API_KEY),
+            ("TAVILY_API_KEY", self.TAVILY_API_KEY),
+        ):
+            if value and os.environ.get(key) != value:
+                os.environ[key] = value
         
         # 设置 LangSmith（已禁用）
-        # if cls.LANGCHAIN_TRACING_V2:
+        # if self.LANGCHAIN_TRACING_V2:
         #     os.environ["LANGCHAIN_TRACING_V2"] = "true"
-        #     if cls.LANGCHAIN_API_KEY:
-        #         os.environ["LANGCHAIN_API_KEY"] = cls.LANGCHAIN_API_KEY
-        #     os.environ["LANGCHAIN_PROJECT"] = cls.LANGCHAIN_PROJECT
+        #     if self.LANGCHAIN_API_KEY:
+        #         os.environ["LANGCHAIN_API_KEY"] = self.LANGCHAIN_API_KEY
+        #     os.environ["LANGCHAIN_PROJECT"] = self.LANGCHAIN_PROJECT
         
         # 显式禁用 LangSmith 追踪
         os.environ["LANGCHAIN_TRACING_V2"] = "false"
         
         
+        # 配置节点/边缘的日志：调试模式下输出每一步的执行轨迹
+        logger = logging.getLogger("adaptive_rag")
+        logger.setLevel(logging.DEBUG if self.DEBUG_MODE else logging.INFO)
+        if not logger.handlers:
+            handler = logging.StreamHandler(sys.stdout)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+            logger.propagate = False
+        
         # 禁用 LangSmith 相关警告
         import warnings
         warnings.filterwarnings("ignore", ".*LangSmith.*")
 
 
-def get_config() -> Config:
+@lru_cache(maxsize=1)
+def get_config() -> _Config:
     """
     获取配置实例
     
+    首次调用时加载 .env 并创建单例，之后直接返回缓存的实例。
+    
     返回:
-        Config 实例
+        全局唯一的配置实例
     """
-    return Config()
+    # 合并 .env 中的变量，已存在的环境变量优先
+    for key, value in _env_dict().items():
+        if value is not None:
+            os.environ.setdefault(key, value)
+    return _Config()
 
 
 def check_api_keys() -> bool:
@@ -24,13 +24,13 @@ def demo_workflow_structure():
        - GradeDocuments: 文档评分模型
        - GradeHallucinations: 幻觉检测模型
        - GradeAnswer: 答案质量评分模型
+       - GradeGeneration: 生成质量综合评分模型
     
     2. LLM 组件 (llm_components.py)
        - 问题路由器
        - 文档评分器
        - RAG 生成链
-       - 幻觉检测器
-       - 答案评分器
+       - 生成质量评分器（幻觉检测 + 答案评分）
        - 问题重写器
     
     3. 检索系统 (retriever.py)
@@ -211,9 +211,8 @@ def main():
         elif choice == "2":
             demo_execution_flow()
         elif choice == "3":
-            # 创建一个模拟的工作流对象来展示结构
-            workflow = AdaptiveRAGWorkflow()
-            print(workflow.visualize_graph())
+            # 图结构是静态描述，无需构建工作流（避免初始化 LLM 和向量存储）
+            print(AdaptiveRAGWorkflow.visualize_graph())
         elif choice == "4":
             print("\n再见！")
             break
@@ -10,13 +10,27 @@ LangGraph 核心概念：
 - 边缘函数返回下一个节点的名称
 """
 
+import logging
 from typing import Literal
-from pprint import pprint
 
-from models import GraphState
+from config import get_config
+from models import GraphState, LRUCache
 from llm_components import LLMComponents
 
 
+logger = logging.getLogger("adaptive_rag")
+
+# 路由表：数据源 -> 下一个节点的路由键
+_ROUTE_TABLE = {"web_search": "web_search", "vectorstore": "vectorstore", "both": "both"}
+
+# 路由决策说明，仅用于输出
+_ROUTE_MESSAGES = {
+    "web_search": ("---路由决策：网络搜索---", "原因：问题需要最新信息或不在知识库范围内"),
+    "vectorstore": ("---路由决策：向量存储---", "原因：问题与知识库主题相关"),
+    "both": ("---路由决策：向量存储 + 网络搜索---", "原因：路由置信度较低，两个数据源同时检索"),
+}
+
+
 class GraphEdges:
     """
     图边缘管理类
@@ -34,12 +48,14 @@ class GraphEdges:
         """
         self.llm_components = llm_components
         
-        # 创建所需的 LLM 链
-        self.question_router = llm_components.create_question_router()
-        self.hallucination_grader = llm_components.create_hallucination_grader()
-        self.answer_grader = llm_components.create_answer_grader()
+        # 引用 LLM 组件中缓存的链（只构建一次）
+        self.question_router = llm_components.question_router
+        self.generation_grader = llm_components.generation_grader
+        
+        # 路由决策缓存：规范化问题 -> 数据源（LRU 淘汰，内存占用有上限）
+        self._route_cache = LRUCache(get_config().DECISION_CACHE_SIZE)
     
-    def route_question(self, state: GraphState) -> Literal["vectorstore", "web_search"]:
+    def route_question(self, state: GraphState) -> Literal["vectorstore", "web_search", "both"]:
         """
         问题路由边缘函数
         
@@ -55,22 +71,29 @@ class GraphEdges:
             state: 当前图状态
             
         返回:
-            下一个节点的名称："vectorstore" 或 "web_search"
+            下一个节点的名称："vectorstore"、"web_search"，
+            或在 LLM 路由置信度较低时返回 "both"
         """
-        print("---路由问题---")
+        logger.debug("---路由问题---")
         question = state["question"]
         
-        # 使用 LLM 决定路由
-        source = self.question_router.invoke({"question": question})
-        
-        if source.datasource == "web_search":
-            print("---路由决策：网络搜索---")
-            print("原因：问题需要最新信息或不在知识库范围内")
-            return "web_search"
-        elif source.datasource == "vectorstore":
-            print("---路由决策：向量存储---")
-            print("原因：问题与知识库主题相关")
-            return "vectorstore"
+        # 相同问题直接复用之前的决策；
+        # 否则先尝试嵌入快速路由，置信度不足时再调用 LLM
+        key = question.strip().lower()
+        datasource = self._route_cache.get(key)
+        if datasource is None:
+            datasource = self.llm_components.embedding_route(question)
+            if datasource is None:
+                source = self.question_router.invoke({"question": question})
+                datasource = source.datasource
+                if source.confidence < get_config().ROUTER_CONFIDENCE_THRESHOLD:
+                    datasource = "both"
+            self._route_cache[key] = datasource
+        
+        # 查表路由，未知的数据源回退到向量存储
+        route = _ROUTE_TABLE.get(datasource, "vectorstore")
+        logger.debug("%s\n%s", *_ROUTE_MESSAGES[route])
+        return route
     
     def decide_to_generate(self, state: GraphState) -> Literal["transform_query", "generate"]:
         """
@@ -89,24 +112,29 @@ class GraphEdges:
         返回:
             下一个节点的名称："generate" 或 "transform_query"
         """
-        print("---评估文档质量---")
+        logger.debug("---评估文档质量---")
         filtered_documents = state.get("documents", [])
         
+        if not filtered_documents and self._retries_exhausted(state):
+            # 重写次数已达上限，不再继续循环，用现有信息生成答案
+            logger.debug("---决策：重写次数已达上限，直接生成答案---")
+            return "generate"
+        
         if not filtered_documents:
             # 所有文档都被过滤掉了，需要重写查询
-            print("---决策：所有文档都不相关，转换查询---")
-            print("原因：检索到的文档与问题不匹配")
+            logger.debug("---决策：所有文档都不相关，转换查询---")
+            logger.debug("原因：检索到的文档与问题不匹配")
             return "transform_query"
         else:
             # 有相关文档，可以生成答案
-            print("---决策：生成答案---")
-            print(f"原因：找到 {len(filtered_documents)} 个相关文档")
+            logger.debug("---决策：生成答案---")
+            logger.debug("原因：找到 %d 个相关文档", len(filtered_documents))
             return "generate"
     
     def grade_generation_v_documents_and_question(
         self, 
         state: GraphState
-    ) -> Literal["useful", "not useful", "not supported"]:
+    ) -> Literal["useful", "not useful", "not supported", "max retries"]:
         """
         评估生成质量的边缘函数
         
@@ -124,43 +152,135 @@ class GraphEdges:
             state: 当前图状态
             
         返回:
-            评估结果："useful"、"not useful" 或 "not supported"
+            评估结果："useful"、"not useful"、"not supported" 或 "max retries"
         """
-        print("---检查幻觉---")
+        logger.debug("---检查幻觉与答案质量---")
+        if state.get("generation_aborted"):
+            return self._cap_retries(state, self._aborted_generation())
+        
         question = state["question"]
-        documents = state["documents"]
+        documents = state["formatted_documents"]
         generation = state["generation"]
         
-        # 第一步：检查是否有幻觉
-        score = self.hallucination_grader.invoke({
+        # 一次调用同时完成幻觉检测和答案质量评估
+        score = self.generation_grader.invoke({
             "documents": documents,
+            "question": question,
             "generation": generation
         })
-        grade = score.binary_score
+        decision = self._decide_generation(
+            score.binary_hallucination,
+            score.binary_answer
+        )
+        return self._cap_retries(state, decision)
+    
+    async def agrade_generation_v_documents_and_question(
+        self, 
+        state: GraphState
+    ) -> Literal["useful", "not useful", "not supported", "max retries"]:
+        """
+        评估生成质量的边缘函数（异步版本）
         
-        if grade == "yes":
-            print("---决策：生成基于事实---")
+        参数:
+            state: 当前图状态
             
-            # 第二步：检查是否回答了问题
-            print("---评估答案质量---")
-            score = self.answer_grader.invoke({
-                "question": question,
-                "generation": generation
-            })
-            grade = score.binary_score
+        返回:
+            评估结果："useful"、"not useful"、"not supported" 或 "max retries"
+        """
+        logger.debug("---检查幻觉与答案质量---")
+        if state.get("generation_aborted"):
+            return self._cap_retries(state, self._aborted_generation())
+        
+        question = state["question"]
+        documents = state["formatted_documents"]
+        generation = state["generation"]
+        
+        score = await self.generation_grader.ainvoke({
+            "documents": documents,
+            "question": question,
+            "generation": generation
+        })
+        decision = self._decide_generation(
+            score.binary_hallucination,
+            score.binary_answer
+        )
+        return self._cap_retries(state, decision)
+    
+    def _aborted_generation(self) -> Literal["not useful"]:
+        """
+        生成节点已提前终止时的路由决策
+        
+        流式生成阶段已判定为疑似幻觉，无需再调用评分器，
+        直接转换查询以获取更好的文档。
+        
+        返回:
+            "not useful"
+        """
+        logger.debug("---决策：生成已提前终止，转换查询---")
+        logger.debug("原因：答案包含文档中不存在的数字")
+        return "not useful"
+    
+    def _retries_exhausted(self, state: GraphState) -> bool:
+        """
+        查询重写次数是否已达上限（Config.MAX_ITERATIONS）
+        
+        参数:
+            state: 当前图状态
             
-            if grade == "yes":
-                print("---决策：答案有用---")
-                print("原因：答案基于事实且回答了问题")
-                return "useful"
-            else:
-                print("---决策：答案未充分回答问题---")
-                print("原因：虽然基于事实，但未直接回答用户问题")
-                return "not useful"
-        else:
-            print("---决策：生成包含幻觉，需要重试---")
-            print("原因：答案包含文档中不存在的信息")
+        返回:
+            是否应停止继续重写查询
+        """
+        return self.should_continue_retrieval(state, get_config().MAX_ITERATIONS) == "stop"
+    
+    def _cap_retries(
+        self,
+        state: GraphState,
+        decision: Literal["useful", "not useful", "not supported"]
+    ) -> Literal["useful", "not useful", "not supported", "max retries"]:
+        """
+        限制"答案不好 -> 转换查询"循环的次数
+        
+        参数:
+            state: 当前图状态
+            decision: 原始路由决策
+            
+        返回:
+            重写次数已达上限时返回 "max retries"（结束工作流），否则返回原决策
+        """
+        if decision == "not useful" and self._retries_exhausted(state):
+            logger.debug("---决策：重写次数已达上限，返回当前答案---")
+            return "max retries"
+        return decision
+    
+    def _decide_generation(
+        self,
+        hallucination_grade: str,
+        answer_grade: str
+    ) -> Literal["useful", "not useful", "not supported"]:
+        """
+        根据幻觉评分和答案评分给出路由决策
+        
+        参数:
+            hallucination_grade: 幻觉检测结果（'yes' 表示基于事实）
+            answer_grade: 答案质量评分结果
+            
+        返回:
+            评估结果："useful"、"not useful" 或 "not supported"
+        """
+        if hallucination_grade != "yes":
+            logger.debug("---决策：生成包含幻觉，需要重试---")
+            logger.debug("原因：答案包含文档中不存在的信息")
             return "not supported"
+        
+        logger.debug("---决策：生成基于事实---")
+        if answer_grade == "yes":
+            logger.debug("---决策：答案有用---")
+            logger.debug("原因：答案基于事实且回答了问题")
+            return "useful"
+        
+        logger.debug("---决策：答案未充分回答问题---")
+        logger.debug("原因：虽然基于事实，但未直接回答用户问题")
+        return "not useful"
     
     def should_continue_retrieval(
         self, 
@@ -184,10 +304,10 @@ class GraphEdges:
         iterations = state.get("iterations", 0)
         
         if iterations >= max_iterations:
-            print(f"---达到最大迭代次数 ({max_iterations})，停止---")
+            logger.debug("---达到最大迭代次数 (%d)，停止---", max_iterations)
             return "stop"
         else:
-            print(f"---继续迭代 (当前: {iterations}/{max_iterations})---")
+            logger.debug("---继续迭代 (当前: %d/%d)---", iterations, max_iterations)
             return "continue"
     
     def debug_routing_decision(
@@ -206,9 +326,9 @@ class GraphEdges:
             decision: 做出的决策
             reason: 决策原因
         """
-        print("\n=== 路由决策 ===")
-        print(f"当前问题: {state.get('question', 'N/A')}")
-        print(f"决策: {decision}")
-        if reason:
-            print(f"原因: {reason}")
-        print("===============\n")
\ No newline at end of file
+        logger.debug(
+            "\n=== 路由决策 ===\n当前问题: %s\n决策: %s%s\n===============\n",
+            state.get("question", "N/A"),
+            decision,
+            f"\n原因: {reason}" if reason else "",
+        )
\ No newline at end of file
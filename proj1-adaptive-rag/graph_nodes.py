@@ -10,14 +10,27 @@ LangGraph 核心概念：
 - 节点之间通过状态传递信息
 """
 
-from typing import Dict, Any
+import asyncio
+import hashlib
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from itertools import compress
+from typing import Dict, Any, List, Tuple
 from langchain_core.documents import Document
 
-from models import GraphState
+from config import get_config
+from models import GraphState, LRUCache
 from llm_components import LLMComponents
 from tools import ToolManager
 
 
+logger = logging.getLogger("adaptive_rag")
+
+# 评分结果中表示"相关"的取值
+_YES = "yes"
+
+
 class GraphNodes:
     """
     图节点管理类
@@ -44,10 +57,23 @@ class GraphNodes:
         self.llm_components = llm_components
         self.tool_manager = tool_manager
         
-        # 创建所有需要的 LLM 链
-        self.rag_chain = llm_components.create_rag_chain()
-        self.retrieval_grader = llm_components.create_retrieval_grader()
-        self.question_rewriter = llm_components.create_question_rewriter()
+        # 引用 LLM 组件中缓存的链（只构建一次）
+        self.rag_chain = llm_components.rag_chain
+        self.retrieval_grader = llm_components.retrieval_grader
+        self.question_rewriter = llm_components.question_rewriter
+        
+        # 问题重写缓存：规范化问题 -> 重写结果（跨运行复用，LRU 淘汰）
+        self._rewrite_cache = LRUCache(get_config().DECISION_CACHE_SIZE)
+        
+        # 文档评分和检索结果只在单次运行内复用，保存在图状态中（grade_memo / retrieval_memo），
+        # 而不是实例上：并发运行（run_batch）之间互不干扰
+        
+        # 词面预过滤：分词器与统计计数（checked 为参与预过滤的文档数，skipped 为被直接判为不相关的文档数）
+        self._token_pattern = re.compile(r"\w+")
+        self.prefilter_stats = {"checked": 0, "skipped": 0}
+        
+        # 幻觉快速检查：只匹配数字（专有名词在正常答案中也很常见，误判太多）
+        self._entity_pattern = re.compile(r"\b\d[\d.,]*\b")
     
     def retrieve(self, state: GraphState) -> Dict[str, Any]:
         """
@@ -67,15 +93,82 @@ class GraphNodes:
         返回:
             包含更新字段的字典
         """
-        print("---检索文档---")
+        logger.debug("---检索文档---")
         question = state["question"]
         
-        # 使用检索器获取相关文档
-        documents = self.retriever.invoke(question)
+        # 使用检索器获取相关文档（本次运行中检索过的问题直接复用结果）
+        # 重写在两个问题之间来回变化时，不再重复检索
+        memo = dict(state.get("retrieval_memo") or {})
+        key = question.strip().lower()
+        documents = memo.get(key)
+        if documents is None:
+            documents = self.retriever.invoke(question)
+            memo[key] = documents
         
         # 返回更新的状态字段
         # LangGraph 会自动合并这些更新到全局状态
-        return {"documents": documents, "question": question}
+        return {"documents": documents, "question": question, "retrieval_memo": memo}
+    
+    async def aretrieve_batch(
+        self,
+        questions: List[str],
+        memo: Dict[str, List[Document]]
+    ) -> List[List[Document]]:
+        """
+        批量检索多个问题
+        
+        通过 abatch 并发检索，每个问题对应一组文档；
+        本次运行中检索过的问题直接复用结果。
+        
+        参数:
+            questions: 问题列表
+            memo: 本次运行的检索结果缓存，新结果会写入其中
+            
+        返回:
+            与问题一一对应的文档列表
+        """
+        keys = [q.strip().lower() for q in questions]
+        pending = [i for i, key in enumerate(keys) if key not in memo]
+        if pending:
+            results = await self.retriever.abatch([questions[i] for i in pending])
+            for i, docs in zip(pending, results):
+                memo[keys[i]] = docs
+        return [memo[key] for key in keys]
+    
+    async def aretrieve(self, state: GraphState) -> Dict[str, Any]:
+        """
+        检索节点（异步版本）
+        
+        问题被重写过时，同时检索重写后的问题和原始问题，
+        两组结果去重合并（重写结果优先），交给文档评分节点过滤。
+        两次检索并发执行，不增加额外的等待时间。
+        
+        参数:
+            state: 当前图状态
+            
+        返回:
+            包含更新字段的字典
+        """
+        logger.debug("---检索文档---")
+        question = state["question"]
+        original = state.get("original_question")
+        memo = dict(state.get("retrieval_memo") or {})
+        
+        if not original or original == question:
+            (documents,) = await self.aretrieve_batch([question], memo)
+            return {"documents": documents, "question": question, "retrieval_memo": memo}
+        
+        rewritten_docs, original_docs = await self.aretrieve_batch([question, original], memo)
+        
+        # 按内容去重，保持重写问题的结果在前
+        documents = []
+        seen = set()
+        for d in rewritten_docs + original_docs:
+            if d.page_content not in seen:
+                seen.add(d.page_content)
+                documents.append(d)
+        
+        return {"documents": documents, "question": question, "retrieval_memo": memo}
     
     def generate(self, state: GraphState) -> Dict[str, Any]:
         """
@@ -90,24 +183,136 @@ class GraphNodes:
         返回:
             包含生成答案的更新状态
         """
-        print("---生成答案---")
+        logger.debug("---生成答案---")
         question = state["question"]
         documents = state["documents"]
         
-        # 调用 RAG 链生成答案
-        # 将文档和问题作为上下文传递给 LLM
-        generation = self.rag_chain.invoke({
-            "context": documents,
-            "question": question
-        })
+        # 文档只格式化一次，生成和后续的质量评估共用同一份文本
+        formatted = self.llm_components.format_docs(documents)
+        
+        # 流式调用 RAG 链生成答案
+        # 将文档和问题作为上下文传递给 LLM，发现明显幻觉时提前终止
+        generation, aborted = self._stream_generation(formatted, question)
         
         # 更新状态，添加生成的答案
         return {
             "documents": documents,
             "question": question,
-            "generation": generation
+            "generation": generation,
+            "formatted_documents": formatted,
+            "generation_aborted": aborted
+        }
+    
+    def _stream_generation(self, context: str, question: str) -> Tuple[str, bool]:
+        """
+        流式生成答案，并对已生成的部分做幻觉快速检查
+        
+        启用 HALLUCINATION_EARLY_ABORT 时，每隔 HALLUCINATION_CHECK_INTERVAL
+        个片段检查一次：如果答案中出现了较多文档里不存在的数字，
+        立即终止生成，避免为注定被判为幻觉的答案继续付费。
+        完整答案仍由生成质量评分器做最终把关。
+        
+        参数:
+            context: 格式化后的文档文本
+            question: 当前问题
+            
+        返回:
+            (已生成的文本, 是否提前终止)
+        """
+        config = get_config()
+        check = config.HALLUCINATION_EARLY_ABORT
+        context_lower = context.lower()
+        parts = []
+        
+        stream = self.rag_chain.stream({"context": context, "question": question})
+        try:
+            for i, chunk in enumerate(stream, 1):
+                parts.append(chunk)
+                if check and i % config.HALLUCINATION_CHECK_INTERVAL == 0 and self._has_unsupported_entities(
+                    "".join(parts), context_lower
+                ):
+                    logger.debug("---生成提前终止：答案包含文档中不存在的数字---")
+                    return "".join(parts), True
+        finally:
+            stream.close()
+        
+        return "".join(parts), False
+    
+    async def agenerate(self, state: GraphState) -> Dict[str, Any]:
+        """
+        生成节点（异步版本）
+        
+        参数:
+            state: 当前图状态
+            
+        返回:
+            包含生成答案的更新状态
+        """
+        logger.debug("---生成答案---")
+        question = state["question"]
+        documents = state["documents"]
+        
+        formatted = self.llm_components.format_docs(documents)
+        generation, aborted = await self._astream_generation(formatted, question)
+        
+        return {
+            "documents": documents,
+            "question": question,
+            "generation": generation,
+            "formatted_documents": formatted,
+            "generation_aborted": aborted
         }
     
+    async def _astream_generation(self, context: str, question: str) -> Tuple[str, bool]:
+        """
+        流式生成答案（异步版本），幻觉快速检查与同步版本相同
+        
+        参数:
+            context: 格式化后的文档文本
+            question: 当前问题
+            
+        返回:
+            (已生成的文本, 是否提前终止)
+        """
+        config = get_config()
+        check = config.HALLUCINATION_EARLY_ABORT
+        context_lower = context.lower()
+        parts = []
+        
+        stream = self.rag_chain.astream({"context": context, "question": question})
+        try:
+            i = 0
+            async for chunk in stream:
+                i += 1
+                parts.append(chunk)
+                if check and i % config.HALLUCINATION_CHECK_INTERVAL == 0 and self._has_unsupported_entities(
+                    "".join(parts), context_lower
+                ):
+                    logger.debug("---生成提前终止：答案包含文档中不存在的数字---")
+                    return "".join(parts), True
+        finally:
+            await stream.aclose()
+        
+        return "".join(parts), False
+    
+    def _has_unsupported_entities(self, text: str, context_lower: str) -> bool:
+        """
+        判断文本中是否有过多文档里不存在的数字
+        
+        参数:
+            text: 已生成的文本
+            context_lower: 小写的文档文本
+            
+        返回:
+            是否疑似幻觉
+        """
+        entities = set(self._entity_pattern.findall(text))
+        unsupported = [e for e in entities if e.lower() not in context_lower]
+        return (
+            len(unsupported) >= get_config().HALLUCINATION_MIN_ENTITIES
+            and len(unsupported) * 2 > len(entities)
+        )
+    
     def grade_documents(self, state: GraphState) -> Dict[str, Any]:
         """
         文档评分节点
@@ -125,29 +330,145 @@ class GraphNodes:
         返回:
             包含过滤后文档的更新状态
         """
-        print("---检查文档相关性---")
+        logger.debug("---检查文档相关性---")
         question = state["question"]
-        documents = state["documents"]
+        documents = self._prefilter_documents(question, state["documents"])
+        
+        # 只为本次运行中尚未评过的文档调用评分器
+        # 各文档评分互相独立，通过 batch 并发调用，而不是逐个等待
+        memo = dict(state.get("grade_memo") or {})
+        keys = [self._grade_key(question, d) for d in documents]
+        pending = [i for i, key in enumerate(keys) if key not in memo]
+        if pending:
+            inputs = [
+                {"question": question, "document": documents[i].page_content}
+                for i in pending
+            ]
+            scores = self.retrieval_grader.batch(
+                inputs,
+                config={"max_concurrency": get_config().MAX_CONCURRENCY}
+            )
+            for i, score in zip(pending, scores):
+                memo[keys[i]] = score.binary_score
+        
+        # 返回过滤后的文档
+        grades = [memo[key] for key in keys]
+        filtered_docs = self._keep_relevant(documents, grades)
+        return {"documents": filtered_docs, "question": question, "grade_memo": memo}
+    
+    async def agrade_documents(self, state: GraphState) -> Dict[str, Any]:
+        """
+        文档评分节点（异步版本）
+        
+        各文档的评分互相独立，这里通过 abatch 并发评分，
+        总耗时约等于最慢的一次 LLM 调用，而不是所有调用之和。
+        
+        参数:
+            state: 当前图状态
+            
+        返回:
+            包含过滤后文档的更新状态
+        """
+        logger.debug("---检查文档相关性（并发）---")
+        question = state["question"]
+        documents = self._prefilter_documents(question, state["documents"])
+        
+        # 只为本次运行中尚未评过的文档调用评分器
+        memo = dict(state.get("grade_memo") or {})
+        keys = [self._grade_key(question, d) for d in documents]
+        pending = [i for i, key in enumerate(keys) if key not in memo]
+        if pending:
+            inputs = [
+                {"question": question, "document": documents[i].page_content}
+                for i in pending
+            ]
+            scores = await self.retrieval_grader.abatch(
+                inputs,
+                config={"max_concurrency": get_config().MAX_CONCURRENCY}
+            )
+            for i, score in zip(pending, scores):
+                memo[keys[i]] = score.binary_score
+        
+        grades = [memo[key] for key in keys]
+        filtered_docs = self._keep_relevant(documents, grades)
+        return {"documents": filtered_docs, "question": question, "grade_memo": memo}
+    
+    def _keep_relevant(self, documents: List[Document], grades: List[str]) -> List[Document]:
+        """
+        根据评分结果保留相关文档
+        
+        参数:
+            documents: 文档列表
+            grades: 与文档一一对应的评分
+            
+        返回:
+            评为相关的文档列表
+        """
+        mask = [grade == _YES for grade in grades]
+        if logger.isEnabledFor(logging.DEBUG):
+            for relevant in mask:
+                logger.debug("---评分：文档相关---" if relevant else "---评分：文档不相关---")
+        return list(compress(documents, mask))
+    
+    @staticmethod
+    def _grade_key(question: str, document: Document) -> str:
+        """
+        计算评分缓存的键
+        
+        相关性取决于问题和文档两者，因此键由两者的内容共同哈希得到。
+        
+        参数:
+            question: 当前问题
+            document: 文档
+            
+        返回:
+            64 位 blake2b 摘要
+        """
+        return hashlib.blake2b(
+            f"{question}\0{document.page_content}".encode(),
+            digest_size=8
+        ).hexdigest()
+    
+    def _prefilter_documents(self, question: str, documents: List[Document]) -> List[Document]:
+        """
+        词面预过滤
+        
+        与问题没有任何词面重叠的文档显然不相关，直接判为不相关，
+        不再为它们调用 LLM 评分；其余文档仍交给 LLM 评分器。
+        
+        参数:
+            question: 当前问题
+            documents: 待评分的文档列表
+            
+        返回:
+            需要进一步由 LLM 评分的文档列表
+        """
+        # 非 ASCII 问题（如中文）无法与英文文档做词面比较，跳过预过滤
+        if not question.isascii():
+            return documents
         
-        # 评分每个文档
-        filtered_docs = []
+        q_tokens = set(self._token_pattern.findall(question.lower()))
+        if not q_tokens:
+            return documents
+        
+        threshold = get_config().LEXICAL_PREFILTER_THRESHOLD
+        candidates = []
         for d in documents:
-            # 调用相关性评分器
-            score = self.retrieval_grader.invoke({
-                "question": question,
-                "document": d.page_content
-            })
-            
-            grade = score.binary_score
-            if grade == "yes":
-                print("---评分：文档相关---")
-                filtered_docs.append(d)
-            else:
-                print("---评分：文档不相关---")
+            doc_tokens = set(self._token_pattern.findall(d.page_content.lower()))
+            overlap = len(q_tokens & doc_tokens) / len(q_tokens)
+            if overlap < threshold:
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("---评分：文档不相关（词面预过滤）---")
                 continue
+            candidates.append(d)
         
-        # 返回过滤后的文档
-        return {"documents": filtered_docs, "question": question}
+        skipped = len(documents) - len(candidates)
+        self.prefilter_stats["checked"] += len(documents)
+        self.prefilter_stats["skipped"] += skipped
+        if skipped:
+            logger.info("词面预过滤跳过 %d/%d 个文档的 LLM 评分", skipped, len(documents))
+        
+        return candidates
     
     def transform_query(self, state: GraphState) -> Dict[str, Any]:
         """
@@ -166,18 +487,56 @@ class GraphNodes:
         返回:
             包含重写问题的更新状态
         """
-        print("---转换查询---")
+        logger.debug("---转换查询---")
         question = state["question"]
         documents = state["documents"]
         
-        # 使用 LLM 重写问题
-        better_question = self.question_rewriter.invoke({"question": question})
+        # 使用 LLM 重写问题，相同问题直接复用之前的重写结果
+        key = question.strip().lower()
+        better_question = self._rewrite_cache.get(key)
+        if better_question is None:
+            better_question = self.question_rewriter.invoke({"question": question})
+            self._rewrite_cache[key] = better_question
         
-        print(f"原始问题: {question}")
-        print(f"重写后的问题: {better_question}")
+        logger.info("原始问题: %s", question)
+        logger.info("重写后的问题: %s", better_question)
         
-        # 更新问题字段
-        return {"documents": documents, "question": better_question}
+        # 更新问题字段，记录第一次重写前的原始问题，并累计重写次数
+        return {
+            "documents": documents,
+            "question": better_question,
+            "original_question": state.get("original_question") or question,
+            "iterations": state.get("iterations", 0) + 1
+        }
+    
+    async def atransform_query(self, state: GraphState) -> Dict[str, Any]:
+        """
+        查询转换节点（异步版本）
+        
+        参数:
+            state: 当前图状态
+            
+        返回:
+            包含重写问题的更新状态
+        """
+        logger.debug("---转换查询---")
+        question = state["question"]
+        
+        key = question.strip().lower()
+        better_question = self._rewrite_cache.get(key)
+        if better_question is None:
+            better_question = await self.question_rewriter.ainvoke({"question": question})
+            self._rewrite_cache[key] = better_question
+        
+        logger.info("原始问题: %s", question)
+        logger.info("重写后的问题: %s", better_question)
+        
+        return {
+            "documents": state["documents"],
+            "question": better_question,
+            "original_question": state.get("original_question") or question,
+            "iterations": state.get("iterations", 0) + 1
+        }
     
     def web_search(self, state: GraphState) -> Dict[str, Any]:
         """
@@ -196,15 +555,98 @@ class GraphNodes:
         返回:
             包含网络搜索结果的更新状态
         """
-        print("---网络搜索---")
+        logger.debug("---网络搜索---")
         question = state["question"]
         
         # 执行网络搜索
         web_results = self.tool_manager.search_web(question)
         
-        # 将网络搜索结果作为文档返回
-        # 统一格式，便于后续处理
-        return {"documents": web_results, "question": question}
+        # 将网络搜索结果作为文档列表返回
+        # 与检索节点的格式保持一致，便于后续处理
+        return {"documents": [web_results], "question": question}
+    
+    async def aweb_search(self, state: GraphState) -> Dict[str, Any]:
+        """
+        网络搜索节点（异步版本）
+        
+        参数:
+            state: 当前图状态
+            
+        返回:
+            包含网络搜索结果的更新状态
+        """
+        logger.debug("---网络搜索---")
+        question = state["question"]
+        
+        web_results = await self.tool_manager.asearch_web(question)
+        return {"documents": [web_results], "question": question}
+    
+    def retrieve_and_search(self, state: GraphState) -> Dict[str, Any]:
+        """
+        向量检索 + 网络搜索节点
+        
+        路由置信度较低时，同时从两个数据源获取文档并合并，
+        由文档评分节点筛选出相关的部分，避免选错路由后再走一轮重试。
+        
+        参数:
+            state: 当前图状态
+            
+        返回:
+            包含合并文档的更新状态
+        """
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            retrieved = executor.submit(self.retrieve, state)
+            searched = executor.submit(self.web_search, state)
+            retrieved = retrieved.result()
+            documents = retrieved["documents"] + searched.result()["documents"]
+        return {
+            "documents": documents,
+            "question": state["question"],
+            "retrieval_memo": retrieved["retrieval_memo"]
+        }
+    
+    async def aretrieve_and_search(self, state: GraphState) -> Dict[str, Any]:
+        """
+        向量检索 + 网络搜索节点（异步版本）
+        
+        参数:
+            state: 当前图状态
+            
+        返回:
+            包含合并文档的更新状态
+        """
+        retrieved, searched = await asyncio.gather(
+            self.aretrieve(state),
+            self.aweb_search(state)
+        )
+        documents = retrieved["documents"] + searched["documents"]
+        return {
+            "documents": documents,
+            "question": state["question"],
+            "retrieval_memo": retrieved["retrieval_memo"]
+        }
+    
+    def max_retries(self, state: GraphState) -> Dict[str, Any]:
+        """
+        重写次数达到上限时的收尾节点
+        
+        标记本次答案未通过质量检查，调用方据此决定是否缓存答案。
+        同时带上当前答案，只接收最后一个节点更新的调用方也能拿到它；
+        答案在生成中途被终止时只剩半句话，改为返回明确的兜底提示。
+        
+        参数:
+            state: 当前图状态
+            
+        返回:
+            包含最终答案和 retries_exhausted 标记的更新状态
+        """
+        if state.get("generation_aborted"):
+            logger.debug("---重写次数已达上限，且答案被提前终止，返回兜底提示---")
+            generation = get_config().UNVERIFIED_ANSWER_FALLBACK
+        else:
+            logger.debug("---重写次数已达上限，返回未经验证的答案---")
+            generation = state.get("generation", "")
+        return {"generation": generation, "retries_exhausted": True}
     
     def format_final_output(self, state: GraphState) -> str:
         """
@@ -234,13 +676,14 @@ class GraphNodes:
         """
         调试辅助函数
         
-        打印当前状态信息，用于调试和监控。
+        以 DEBUG 级别记录当前状态信息，用于调试和监控。
         
         参数:
             state: 当前图状态
         """
-        print("\n=== 当前状态 ===")
-        print(f"问题: {state.get('question', 'N/A')}")
-        print(f"文档数量: {len(state.get('documents', []))}")
-        print(f"是否有生成: {'是' if state.get('generation') else '否'}")
-        print("================\n")
\ No newline at end of file
+        logger.debug(
+            "\n=== 当前状态 ===\n问题: %s\n文档数量: %d\n是否有生成: %s\n================\n",
+            state.get("question", "N/A"),
+            len(state.get("documents", [])),
+            "是" if state.get("generation") else "否",
+        )
\ No newline at end of file
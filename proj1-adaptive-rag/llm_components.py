@@ -10,12 +10,103 @@ LLM 组件模块
 - 问题重写器
 """
 
-from langchain import hub
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain_openai import ChatOpenAI
+import hashlib
+from functools import cached_property, lru_cache
+from pathlib import Path
+from typing import Optional
 
-from models import RouteQuery, GradeDocuments, GradeHallucinations, GradeAnswer
+# LangChain 相关模块导入开销很大，统一推迟到首次构建链时再导入，
+# 使得仅导入本模块（如 demo、测试）时不必加载整个 LangChain。
+from config import get_config
+from models import (
+    RouteQuery,
+    GradeDocuments,
+    GradeGeneration,
+)
+
+
+# LangChain Hub 中的 RAG 提示模板
+RAG_PROMPT_NAME = "rlm/rag-prompt"
+
+# 提示模板磁盘缓存的版本号，修改后旧缓存自动失效
+_PROMPT_CACHE_VERSION = "1"
+
+
+@lru_cache(maxsize=1)
+def _pull_rag_prompt():
+    """
+    拉取 LangChain Hub 中的 RAG 提示模板
+    
+    hub.pull 是一次阻塞的网络请求，结果在进程内缓存，
+    多个 LLMComponents 实例共享同一份模板。
+    模板同时序列化到磁盘，后续进程启动时直接加载，无需联网。
+    """
+    key = hashlib.blake2b(
+        f"{RAG_PROMPT_NAME}:{_PROMPT_CACHE_VERSION}".encode(),
+        digest_size=8
+    ).hexdigest()
+    cache_file = Path(get_config().CACHE_DIR) / f"rag-prompt-{key}.json"
+    
+    from langchain_core.load import dumps, loads
+    
+    if cache_file.exists():
+        try:
+            return loads(cache_file.read_text(encoding="utf-8"))
+        except Exception:
+            # 缓存损坏时重新拉取
+            pass
+    
+    # hub 只有在本地缓存未命中时才需要导入
+    from langchain import hub
+    prompt = hub.pull(RAG_PROMPT_NAME)
+    
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        cache_file.write_text(dumps(prompt), encoding="utf-8")
+    except OSError:
+        # 缓存写入失败不影响正常使用
+        pass
+    
+    return prompt
+
+
+@lru_cache(maxsize=1)
+def _install_orjson_parser() -> bool:
+    """
+    让结构化输出的 JSON 解析使用 orjson
+    
+    with_structured_output 通过工具调用返回结果，工具参数由
+    langchain_core.output_parsers.openai_tools 模块中的 json.loads 解析。
+    这里把该模块引用的 json 替换为优先使用 orjson 的封装，
+    对所有评分器、路由器统一生效。未安装 orjson 时保持原样。
+    
+    返回:
+        是否已启用 orjson
+    """
+    try:
+        import orjson
+    except ImportError:
+        return False
+    
+    import json
+    from langchain_core.output_parsers import openai_tools
+    
+    class _OrjsonShim:
+        JSONDecodeError = json.JSONDecodeError
+        
+        @staticmethod
+        def loads(s, **kwargs):
+            try:
+                return orjson.loads(s)
+            except orjson.JSONDecodeError:
+                # orjson 更严格（如不接受控制字符），回退到标准库保持原有容错行为
+                return json.loads(s, **kwargs)
+        
+        def __getattr__(self, name):
+            return getattr(json, name)
+    
+    openai_tools.json = _OrjsonShim()
+    return True
 
 
 class LLMComponents:
@@ -24,21 +115,69 @@ class LLMComponents:
     
     集中管理所有 LLM 相关的组件，提供统一的接口。
     这种设计模式使得组件易于维护和测试。
+    每条链在首次访问时构建，之后复用同一个实例。
     """
     
-    def __init__(self, model_name: str = "gpt-5", temperature: float = 0):
+    def __init__(
+        self,
+        model_name: str = "gpt-5",
+        temperature: float = 0,
+        embedding_model=None,
+        grader_model: Optional[str] = None
+    ):
         """
         初始化 LLM 组件
         
         参数:
-            model_name: OpenAI 模型名称
+            model_name: OpenAI 模型名称，用于生成答案和重写问题
             temperature: 温度参数，控制生成的随机性（0 表示确定性输出）
+            embedding_model: 嵌入模型，用于快速路由；为 None 时始终由 LLM 路由
+            grader_model: 路由和评分使用的模型，默认使用 Config.GRADER_MODEL
         """
         self.model_name = model_name
+        self.grader_model = grader_model or get_config().GRADER_MODEL
         self.temperature = temperature
-        self.llm = ChatOpenAI(model=model_name, temperature=temperature)
+        self.embedding_model = embedding_model
         
-    def create_question_router(self):
+        # 问题嵌入缓存：问题摘要 -> 归一化向量
+        self._embedding_cache = {}
+    
+    @cached_property
+    def llm(self):
+        """
+        共享的 LLM 客户端
+        
+        所有链复用同一个实例（同一个连接池）。
+        """
+        from langchain_openai import ChatOpenAI
+        
+        _install_orjson_parser()
+        # streaming=True 让生成节点逐个 token 返回，交互模式可以边生成边输出
+        return ChatOpenAI(
+            model=self.model_name,
+            temperature=self.temperature,
+            streaming=True
+        )
+    
+    @cached_property
+    def grader_llm(self):
+        """
+        路由和评分共用的小模型客户端
+        
+        这些调用只返回 yes/no 或数据源名称，
+        使用更小的模型并限制输出 token 数即可。
+        """
+        from langchain_openai import ChatOpenAI
+        
+        _install_orjson_parser()
+        return ChatOpenAI(
+            model=self.grader_model,
+            temperature=0,
+            max_tokens=get_config().GRADER_MAX_TOKENS
+        )
+    
+    @cached_property
+    def question_router(self):
         """
         创建问题路由器
         
@@ -48,14 +187,17 @@ class LLMComponents:
         返回:
             可以将问题路由到不同数据源的链
         """
+        from langchain_core.prompts import ChatPromptTemplate
+        
         # 使用结构化输出确保返回格式正确
-        structured_llm_router = self.llm.with_structured_output(RouteQuery)
+        structured_llm_router = self.grader_llm.with_structured_output(RouteQuery)
         
         # 系统提示词：定义路由规则
         system = """你是一个专门的问题路由专家。
         向量存储包含关于以下主题的文档：智能体（agents）、提示工程（prompt engineering）和对抗性攻击（adversarial attacks）。
         对于这些主题的问题，使用向量存储。
-        对于其他问题，特别是关于最新事件、新闻或需要实时信息的问题，使用网络搜索。"""
+        对于其他问题，特别是关于最新事件、新闻或需要实时信息的问题，使用网络搜索。
+        同时给出你对该选择的置信度（0 到 1）；问题可能同时需要两种数据源时，置信度应较低。"""
         
         # 构建提示模板
         route_prompt = ChatPromptTemplate.from_messages([
@@ -66,7 +208,59 @@ class LLMComponents:
         # 返回完整的链
         return route_prompt | structured_llm_router
     
-    def create_retrieval_grader(self):
+    @cached_property
+    def route_prototypes(self):
+        """
+        各路由的原型向量
+        
+        对每个路由的原型问题做一次批量嵌入，取均值并归一化。
+        
+        返回:
+            路由名称 -> 归一化的原型向量
+        """
+        import numpy as np
+        
+        prototypes = {}
+        for route, questions in get_config().ROUTE_PROTOTYPES.items():
+            vectors = np.asarray(self.embedding_model.embed_documents(questions), dtype=np.float32)
+            center = vectors.mean(axis=0)
+            prototypes[route] = center / np.linalg.norm(center)
+        return prototypes
+    
+    def embedding_route(self, question: str) -> Optional[str]:
+        """
+        基于嵌入相似度的快速路由
+        
+        大多数问题的路由结果很明确，将问题向量与各路由的原型向量比较，
+        相似度差距足够大时直接给出路由，省去一次 LLM 调用；
+        置信度不足时返回 None，由 LLM 路由器兜底。
+        
+        参数:
+            question: 用户问题
+            
+        返回:
+            路由名称，置信度不足或未配置嵌入模型时为 None
+        """
+        if self.embedding_model is None:
+            return None
+        
+        import numpy as np
+        
+        key = hashlib.blake2b(question.encode(), digest_size=8).hexdigest()
+        embedding = self._embedding_cache.get(key)
+        if embedding is None:
+            embedding = np.asarray(self.embedding_model.embed_query(question), dtype=np.float32)
+            embedding /= np.linalg.norm(embedding)
+            self._embedding_cache[key] = embedding
+        
+        scores = {route: float(embedding @ p) for route, p in self.route_prototypes.items()}
+        ranked = sorted(scores, key=scores.get, reverse=True)
+        if scores[ranked[0]] - scores[ranked[-1]] > get_config().ROUTER_EMBEDDING_MARGIN:
+            return ranked[0]
+        return None
+    
+    @cached_property
+    def retrieval_grader(self):
         """
         创建文档相关性评分器
         
@@ -76,7 +270,9 @@ class LLMComponents:
         返回:
             文档相关性评分链
         """
-        structured_llm_grader = self.llm.with_structured_output(GradeDocuments)
+        from langchain_core.prompts import ChatPromptTemplate
+        
+        structured_llm_grader = self.grader_llm.with_structured_output(GradeDocuments)
         
         system = """你是一个评估检索文档相关性的评分专家。
         如果文档包含与用户问题相关的关键词或语义信息，将其评为相关。
@@ -90,7 +286,8 @@ class LLMComponents:
         
         return grade_prompt | structured_llm_grader
     
-    def create_rag_chain(self):
+    @cached_property
+    def rag_chain(self):
         """
         创建 RAG 生成链
         
@@ -100,64 +297,45 @@ class LLMComponents:
         返回:
             RAG 生成链
         """
-        # 从 LangChain Hub 拉取经过优化的 RAG 提示模板
-        prompt = hub.pull("rlm/rag-prompt")
+        from langchain_core.output_parsers import StrOutputParser
         
-        # 使用较低成本的模型进行生成
-        llm = ChatOpenAI(model_name="gpt-5", temperature=0)
+        # 从 LangChain Hub 拉取经过优化的 RAG 提示模板
+        prompt = _pull_rag_prompt()
         
+        # 复用共享的 LLM 客户端（同一连接池）
         # 构建链：提示 -> LLM -> 字符串输出
-        return prompt | llm | StrOutputParser()
+        return prompt | self.llm | StrOutputParser()
     
-    def create_hallucination_grader(self):
+    @cached_property
+    def generation_grader(self):
         """
-        创建幻觉检测器
+        创建生成质量综合评分器
         
-        评估生成的答案是否基于提供的文档事实。
-        这是确保答案准确性的重要质量控制步骤。
+        将幻觉检测和答案质量评估合并为一次结构化输出调用，
+        生成评估环节的 LLM 往返次数减半。
         
         返回:
-            幻觉检测链
-        """
-        structured_llm_grader = self.llm.with_structured_output(GradeHallucinations)
-        
-        system = """你是一个评估 LLM 生成内容是否基于事实的专家。
-        判断生成的答案是否有充分的事实依据。
-        给出二元评分 'yes' 或 'no'。
-        'yes' 表示答案基于提供的事实，'no' 表示答案包含未经证实的信息。"""
-        
-        hallucination_prompt = ChatPromptTemplate.from_messages([
-            ("system", system),
-            ("human", "事实集合: \n\n {documents} \n\n LLM 生成: {generation}"),
-        ])
-        
-        return hallucination_prompt | structured_llm_grader
-    
-    def create_answer_grader(self):
+            生成质量综合评分链
         """
-        创建答案质量评分器
+        from langchain_core.prompts import ChatPromptTemplate
         
-        评估生成的答案是否真正回答了用户的问题。
-        即使答案基于事实，也可能没有直接回答问题。
-        
-        返回:
-            答案质量评分链
-        """
-        structured_llm_grader = self.llm.with_structured_output(GradeAnswer)
+        structured_llm_grader = self.grader_llm.with_structured_output(GradeGeneration)
         
-        system = """你是一个评估答案是否解决问题的专家。
-        判断生成的答案是否真正回答了用户的问题。
-        给出二元评分 'yes' 或 'no'。
+        system = """你是一个评估 LLM 生成内容质量的专家，需要同时给出两个二元评分。
+        binary_hallucination：判断生成的答案是否有充分的事实依据，
+        'yes' 表示答案基于提供的事实，'no' 表示答案包含未经证实的信息。
+        binary_answer：判断生成的答案是否真正回答了用户的问题，
         'yes' 表示答案解决了问题，'no' 表示答案未能充分回答问题。"""
         
-        answer_prompt = ChatPromptTemplate.from_messages([
+        generation_prompt = ChatPromptTemplate.from_messages([
             ("system", system),
-            ("human", "用户问题: \n\n {question} \n\n LLM 生成: {generation}"),
+            ("human", "事实集合: \n\n {documents} \n\n 用户问题: {question} \n\n LLM 生成: {generation}"),
         ])
         
-        return answer_prompt | structured_llm_grader
+        return generation_prompt | structured_llm_grader
     
-    def create_question_rewriter(self):
+    @cached_property
+    def question_rewriter(self):
         """
         创建问题重写器
         
@@ -167,8 +345,8 @@ class LLMComponents:
         返回:
             问题重写链
         """
-        # 使用稍微不同的模型版本，可能有更好的重写能力
-        llm = ChatOpenAI(model="gpt-5", temperature=0)
+        from langchain_core.output_parsers import StrOutputParser
+        from langchain_core.prompts import ChatPromptTemplate
         
         system = """你是一个问题重写专家，能够将输入问题转换为更适合向量存储检索的版本。
         分析输入问题的潜在语义意图和含义。
@@ -183,19 +361,37 @@ class LLMComponents:
             ("human", "原始问题: \n\n {question} \n 请提供改进后的问题。"),
         ])
         
-        return re_write_prompt | llm | StrOutputParser()
+        # 复用共享的 LLM 客户端（同一连接池）
+        return re_write_prompt | self.llm | StrOutputParser()
     
     @staticmethod
-    def format_docs(docs):
+    def format_docs(docs, limit: Optional[int] = None):
         """
         格式化文档列表
         
         将文档对象列表转换为字符串格式，便于传递给 LLM。
+        总长度超过上限时截断，避免超出模型上下文窗口、浪费预填充时间。
         
         参数:
             docs: 文档对象列表
+            limit: 最大字符数，默认使用 Config.MAX_CONTEXT_CHARS
             
         返回:
             格式化的文档字符串
         """
-        return "\n\n".join(doc.page_content for doc in docs)
\ No newline at end of file
+        if limit is None:
+            limit = get_config().MAX_CONTEXT_CHARS
+        
+        parts = []
+        total = 0
+        for doc in docs:
+            chunk = doc.page_content
+            if total + len(chunk) > limit:
+                # 只保留剩余额度内的部分
+                if limit > total:
+                    parts.append(chunk[:limit - total])
+                break
+            parts.append(chunk)
+            total += len(chunk) + 2  # 加上分隔符 "\n\n" 的长度
+        
+        return "\n\n".join(parts)
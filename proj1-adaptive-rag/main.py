@@ -4,18 +4,23 @@
 这是 Adaptive RAG 系统的主程序，提供命令行界面和示例用法。
 """
 
+import os
 import sys
 import argparse
+import logging
 from typing import Optional, List
-from pprint import pprint
+from pprint import pformat
 
-from config import Config, get_config
+from config import get_config
 from retriever import VectorStoreManager, create_default_vectorstore
 from llm_components import LLMComponents
 from tools import ToolManager
 from workflow import AdaptiveRAGWorkflow
 
 
+logger = logging.getLogger("adaptive_rag")
+
+
 def setup_system(use_default_docs: bool = True, urls: Optional[List[str]] = None):
     """
     设置系统组件
@@ -33,6 +38,13 @@ def setup_system(use_default_docs: bool = True, urls: Optional[List[str]] = None
     config = get_config()
     config.setup_environment()
     
+    # 全局 LLM 缓存：重试循环中对相同输入的评分、重写直接命中缓存
+    from langchain_core.globals import set_llm_cache
+    from langchain_community.cache import SQLiteCache
+    
+    os.makedirs(config.CACHE_DIR, exist_ok=True)
+    set_llm_cache(SQLiteCache(database_path=config.LLM_CACHE_PATH))
+    
     # 验证配置
     if not config.validate():
         print("错误：配置验证失败，请检查 .env 文件")
@@ -56,7 +68,9 @@ def setup_system(use_default_docs: bool = True, urls: Optional[List[str]] = None
     print("正在初始化 LLM 组件...")
     llm_components = LLMComponents(
         model_name=config.DEFAULT_LLM_MODEL,
-        temperature=config.DEFAULT_TEMPERATURE
+        temperature=config.DEFAULT_TEMPERATURE,
+        embedding_model=vector_store_manager.embedding_model,
+        grader_model=config.GRADER_MODEL
     )
     
     # 4. 创建工具管理器
@@ -98,12 +112,13 @@ def run_example_queries(workflow: AdaptiveRAGWorkflow):
         "What's the latest news about OpenAI?",
     ]
     
-    for i, question in enumerate(example_questions, 1):
+    # 并发运行所有示例问题，再按顺序输出结果
+    results = workflow.run_batch(example_questions)
+    
+    for i, (question, result) in enumerate(zip(example_questions, results), 1):
         print(f"\n示例 {i}: {question}")
         print("-" * 50)
         
-        result = workflow.run(question)
-        
         print(f"\n最终答案:")
         print(result.get("generation", "未能生成答案"))
         print("=" * 50)
@@ -145,14 +160,12 @@ def interactive_mode(workflow: AdaptiveRAGWorkflow):
             if not question:
                 continue
             
-            # 运行查询
+            # 运行查询，答案在生成过程中实时输出
             print("\n处理中...")
-            result = workflow.run(question)
+            result = workflow.run(question, stream_tokens=True)
             
-            # 显示结果
-            print("\n" + "=" * 50)
-            print("答案:")
-            print(result.get("generation", "未能生成答案"))
+            if not result.get("generation"):
+                print("未能生成答案")
             print("=" * 50)
             
         except KeyboardInterrupt:
@@ -245,9 +258,10 @@ def main():
         print("-" * 50)
         
         if args.verbose:
-            result = workflow.run_with_details(args.question)
-            print("\n执行轨迹:")
-            pprint(result["execution_trace"])
+            # --verbose 打开 DEBUG 日志，执行轨迹按需收集并以 DEBUG 级别输出
+            logger.setLevel(logging.DEBUG)
+            result = workflow.run_with_details(args.question, collect_trace=True)
+            logger.debug("\n执行轨迹:\n%s", pformat(result["execution_trace"]))
         else:
             result = workflow.run(args.question)
         
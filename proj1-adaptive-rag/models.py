@@ -5,9 +5,46 @@
 使用 Pydantic 来确保数据验证和类型安全。
 """
 
-from typing import List, Literal
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, List, Literal
 from typing_extensions import TypedDict
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+else:
+    # 运行时不导入 langchain_core（保持延迟加载）；
+    # LangGraph 会用 get_type_hints 解析 GraphState，名称必须可解析
+    Document = Any
+
+
+class LRUCache(OrderedDict):
+    """
+    有界 LRU 字典
+    
+    用于在整个进程生命周期内复用的决策缓存（路由、问题重写），
+    超过容量时淘汰最久未使用的条目，内存占用有上限。
+    """
+    
+    def __init__(self, maxsize: int):
+        """
+        参数:
+            maxsize: 最大条目数
+        """
+        super().__init__()
+        self.maxsize = maxsize
+    
+    def get(self, key, default=None):
+        if key not in self:
+            return default
+        self.move_to_end(key)
+        return self[key]
+    
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        if len(self) > self.maxsize:
+            self.popitem(last=False)
 
 
 class RouteQuery(BaseModel):
@@ -22,6 +59,12 @@ class RouteQuery(BaseModel):
         ...,
         description="根据用户问题选择路由到网络搜索还是向量存储"
     )
+    confidence: float = Field(
+        default=1.0,
+        ge=0.0,
+        le=1.0,
+        description="对该路由选择的置信度，0 到 1 之间"
+    )
 
 
 class GradeDocuments(BaseModel):
@@ -32,7 +75,9 @@ class GradeDocuments(BaseModel):
     这是自纠正 RAG 的重要组成部分，确保只使用相关文档生成答案。
     """
     
-    binary_score: str = Field(
+    model_config = ConfigDict(frozen=True, extra="forbid")
+    
+    binary_score: Literal["yes", "no"] = Field(
         description="文档是否与问题相关，'yes' 或 'no'"
     )
 
@@ -45,7 +90,9 @@ class GradeHallucinations(BaseModel):
     防止模型产生幻觉（虚假信息）是 RAG 系统的关键质量控制点。
     """
     
-    binary_score: str = Field(
+    model_config = ConfigDict(frozen=True, extra="forbid")
+    
+    binary_score: Literal["yes", "no"] = Field(
         description="答案是否基于事实，'yes' 或 'no'"
     )
 
@@ -58,7 +105,27 @@ class GradeAnswer(BaseModel):
     这是质量控制的最后一道关卡。
     """
     
-    binary_score: str = Field(
+    model_config = ConfigDict(frozen=True, extra="forbid")
+    
+    binary_score: Literal["yes", "no"] = Field(
+        description="答案是否解决了问题，'yes' 或 'no'"
+    )
+
+
+class GradeGeneration(BaseModel):
+    """
+    生成质量综合评分模型
+    
+    一次调用同时给出幻觉检测和答案质量两个评分，
+    用于替代 GradeHallucinations + GradeAnswer 的两次串行调用。
+    """
+    
+    model_config = ConfigDict(frozen=True, extra="forbid")
+    
+    binary_hallucination: Literal["yes", "no"] = Field(
+        description="答案是否基于事实，'yes' 或 'no'"
+    )
+    binary_answer: Literal["yes", "no"] = Field(
         description="答案是否解决了问题，'yes' 或 'no'"
     )
 
@@ -79,8 +146,23 @@ class GraphState(TypedDict):
         question: 用户的原始问题或重写后的问题
         generation: LLM 生成的答案
         documents: 检索到的文档列表或网络搜索结果
+        formatted_documents: 拼接好的文档文本，生成与评估共用
+        original_question: 第一次重写前的原始问题
+        generation_aborted: 生成是否因疑似幻觉被提前终止
+        iterations: 已执行的查询转换次数
+        retries_exhausted: 是否因重写次数达到上限而结束（答案未通过质量检查）
+        retrieval_memo: 本次运行的检索结果，规范化问题 -> 文档列表
+        grade_memo: 本次运行的文档评分，(问题, 文档) 摘要 -> 评分
     """
     
     question: str  # 当前的问题（可能被重写过）
     generation: str  # LLM 生成的答案
-    documents: List[str]  # 相关文档列表
\ No newline at end of file
+    documents: List["Document"]  # 相关文档列表（按引用在节点间传递，不会被复制）
+    formatted_documents: str  # 格式化后的文档文本（由生成节点填充）
+    original_question: str  # 原始问题（由查询转换节点填充）
+    generation_aborted: bool  # 生成是否被提前终止（由生成节点填充）
+    iterations: int  # 查询转换次数（由查询转换节点递增）
+    retries_exhausted: bool  # 答案未通过质量检查就结束（由 max_retries 节点填充）
+    # 单次运行内的缓存随状态传递，并发运行之间互不影响
+    retrieval_memo: Dict[str, List["Document"]]  # 检索结果（由检索节点填充）
+    grade_memo: Dict[str, str]  # 文档评分（由评分节点填充）
\ No newline at end of file
@@ -5,12 +5,123 @@
 包括文档加载、分割、向量化和检索等功能。
 """
 
-from typing import List, Optional
+import hashlib
+import os
+import sqlite3
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, List, Optional
+import numpy as np
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import WebBaseLoader
 from langchain_community.vectorstores import Chroma
 from langchain_openai import OpenAIEmbeddings
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from config import get_config
+
+
+# 分块使用的 tiktoken 编码，与 OpenAI 嵌入模型的分词器一致
+TIKTOKEN_ENCODING = "cl100k_base"
+
+
+@lru_cache(maxsize=1)
+def _tiktoken_encoder():
+    """
+    共享的 tiktoken 编码器
+    
+    BPE 表只加载一次，所有 VectorStoreManager 实例复用。
+    """
+    import tiktoken
+    
+    return tiktoken.get_encoding(TIKTOKEN_ENCODING)
+
+
+def _token_length(text: str) -> int:
+    """按 token 计算文本长度"""
+    return len(_tiktoken_encoder().encode(text, disallowed_special=()))
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    带磁盘缓存的嵌入模型
+    
+    包装任意嵌入模型，将文本向量按 SHA-256(模型名 + 文本) 存入 SQLite。
+    重复运行时，相同的文档块和问题直接命中缓存，无需再调用嵌入 API。
+    向量以 float32 存储，与 Chroma 索引中的精度一致，缓存命中与否检索结果都相同。
+    """
+    
+    def __init__(self, underlying: Embeddings, cache_path: str):
+        """
+        初始化带缓存的嵌入模型
+        
+        参数:
+            underlying: 实际计算嵌入的模型
+            cache_path: SQLite 缓存文件路径
+        """
+        self.underlying = underlying
+        self.namespace = getattr(underlying, "model", type(underlying).__name__)
+        
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)"
+        )
+        self._lock = threading.Lock()
+    
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.namespace}\0{text}".encode()).hexdigest()
+    
+    def _load(self, keys: List[str]) -> Dict[str, List[float]]:
+        """批量读取缓存中的向量"""
+        found = {}
+        with self._lock:
+            for key in keys:
+                row = self._conn.execute(
+                    "SELECT vector FROM embeddings WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    found[key] = np.frombuffer(row[0], dtype=np.float32).tolist()
+        return found
+    
+    def _store(self, items: Dict[str, List[float]]):
+        """批量写入向量"""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [
+                    (key, np.asarray(vector, dtype=np.float32).tobytes())
+                    for key, vector in items.items()
+                ]
+            )
+            self._conn.commit()
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        cached = self._load(keys)
+        
+        # 只为缓存未命中的文本调用嵌入 API
+        missing = [i for i, key in enumerate(keys) if key not in cached]
+        if missing:
+            vectors = self.underlying.embed_documents([texts[i] for i in missing])
+            new_items = {keys[i]: vector for i, vector in zip(missing, vectors)}
+            self._store(new_items)
+            cached.update(new_items)
+        
+        return [cached[key] for key in keys]
+    
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        cached = self._load([key])
+        if key in cached:
+            return cached[key]
+        
+        vector = self.underlying.embed_query(text)
+        self._store({key: vector})
+        return vector
 
 
 class VectorStoreManager:
@@ -23,10 +134,12 @@ class VectorStoreManager:
     
     def __init__(
         self,
-        embedding_model: Optional[OpenAIEmbeddings] = None,
+        embedding_model: Optional[Embeddings] = None,
         collection_name: str = "rag-chroma",
         chunk_size: int = 500,
-        chunk_overlap: int = 0
+        chunk_overlap: int = 0,
+        persist_directory: Optional[str] = ".chroma",
+        embedding_cache_path: Optional[str] = None
     ):
         """
         初始化向量存储管理器
@@ -36,12 +149,28 @@ class VectorStoreManager:
             collection_name: Chroma 集合名称
             chunk_size: 文本分块大小（以 token 为单位）
             chunk_overlap: 分块之间的重叠大小
+            persist_directory: Chroma 持久化目录，为 None 时只保存在内存中
+            embedding_cache_path: 嵌入缓存文件路径，默认位于 Config.CACHE_DIR
         """
         # 如果没有提供嵌入模型，创建默认的 OpenAI 嵌入
-        self.embedding_model = embedding_model or OpenAIEmbeddings()
+        # 并包装磁盘缓存，避免重复调用嵌入 API
+        if embedding_cache_path is None:
+            embedding_cache_path = os.path.join(get_config().CACHE_DIR, "embeddings.sqlite")
+        self.embedding_model = CachedEmbeddings(
+            embedding_model or OpenAIEmbeddings(),
+            embedding_cache_path
+        )
         self.collection_name = collection_name
+        self.persist_directory = persist_directory
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
+        
+        # 文本分割器只创建一次，按 token 计算长度
+        self._splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=_token_length
+        )
         self.vectorstore = None
         self.retriever = None
         
@@ -57,8 +186,10 @@ class VectorStoreManager:
         """
         print(f"正在从 {len(urls)} 个 URL 加载文档...")
         
-        # 并行加载所有 URL 的内容
-        docs = [WebBaseLoader(url).load() for url in urls]
+        # 并行加载所有 URL 的内容：每个 URL 的网络往返相互重叠，
+        # 总耗时接近最慢的一个请求，而不是所有请求之和
+        with ThreadPoolExecutor(max_workers=min(32, len(urls) or 1)) as executor:
+            docs = list(executor.map(lambda url: WebBaseLoader(url).load(), urls))
         
         # 将嵌套列表展平为单一列表
         docs_list = [item for sublist in docs for item in sublist]
@@ -81,45 +212,157 @@ class VectorStoreManager:
         """
         print(f"正在分割 {len(documents)} 个文档...")
         
-        # 使用 tiktoken 编码器创建文本分割器
-        # tiktoken 是 OpenAI 的分词器，能准确计算 token 数量
-        text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
-            chunk_size=self.chunk_size,
-            chunk_overlap=self.chunk_overlap
-        )
-        
         # 分割所有文档
-        doc_splits = text_splitter.split_documents(documents)
+        # 长度由 tiktoken（OpenAI 的分词器）计算，能准确反映 token 数量
+        doc_splits = self._splitter.split_documents(documents)
         
         print(f"文档被分割成 {len(doc_splits)} 个块")
         return doc_splits
     
-    def create_vectorstore(self, documents: List[Document]) -> Chroma:
+    def _open_collection(self, collection_name: str, documents_digest: str) -> Chroma:
+        """
+        打开（或新建）一个 Chroma 集合
+        
+        参数:
+            collection_name: 集合名称
+            documents_digest: 新建集合时记录在元数据中的文档摘要
+            
+        返回:
+            Chroma 向量存储实例
+        """
+        metadata = dict(get_config().CHROMA_COLLECTION_METADATA)
+        metadata["documents_digest"] = documents_digest
+        
+        # Chroma 是一个轻量级的向量数据库，适合开发和小规模应用
+        return Chroma(
+            collection_name=collection_name,
+            embedding_function=self.embedding_model,
+            persist_directory=self.persist_directory,
+            collection_metadata=metadata,
+        )
+    
+    @staticmethod
+    def _documents_digest(documents: List[Document]) -> str:
+        """
+        计算文档集合的摘要
+        
+        由每个文档的 id、来源和内容共同哈希得到，文档有任何变化时摘要随之变化。
+        
+        参数:
+            documents: 文档列表
+            
+        返回:
+            16 位十六进制摘要
+        """
+        h = hashlib.sha256()
+        for doc in documents:
+            for part in (getattr(doc, "id", None) or "", doc.metadata.get("source", ""), doc.page_content):
+                h.update(str(part).encode())
+                h.update(b"\0")
+        return h.hexdigest()[:16]
+    
+    def _make_retriever(self):
+        """
+        基于当前向量存储创建检索器
+        
+        返回:
+            显式指定相似度检索和 k 值的检索器
+        """
+        return self.vectorstore.as_retriever(
+            search_type="similarity",
+            search_kwargs={"k": get_config().RETRIEVAL_K}
+        )
+    
+    def _collection_name_for(self, urls: List[str]) -> str:
+        """
+        根据文档源、分块参数和索引参数生成集合名称
+        
+        这些参数变化时使用新的集合，避免复用过期的索引。
+        
+        参数:
+            urls: 文档 URL 列表
+            
+        返回:
+            集合名称
+        """
+        config = get_config()
+        fingerprint = "\n".join([
+            *urls,
+            str(self.chunk_size),
+            str(self.chunk_overlap),
+            TIKTOKEN_ENCODING,
+            repr(sorted(config.CHROMA_COLLECTION_METADATA.items())),
+        ])
+        digest = hashlib.sha256(fingerprint.encode()).hexdigest()[:12]
+        return f"{self.collection_name}-{digest}"
+    
+    def _add_documents_batched(self, documents: List[Document]):
+        """
+        分批嵌入文档并写入当前集合
+        
+        显式按 EMBEDDING_BATCH_SIZE 分批调用 embed_documents，
+        每个请求携带多个文档块，摊薄 HTTP 往返开销；
+        然后把预先算好的向量直接写入 Chroma 集合。
+        
+        参数:
+            documents: 要写入的文档块
+        """
+        batch_size = get_config().EMBEDDING_BATCH_SIZE
+        texts = [doc.page_content for doc in documents]
+        
+        embeddings = []
+        for start in range(0, len(texts), batch_size):
+            embeddings.extend(self.embedding_model.embed_documents(texts[start:start + batch_size]))
+        
+        self.vectorstore._collection.add(
+            ids=[str(uuid.uuid4()) for _ in documents],
+            embeddings=embeddings,
+            documents=texts,
+            # WebBaseLoader 总会写入 source 等元数据，Chroma 不接受空字典
+            metadatas=[doc.metadata or {"source": ""} for doc in documents],
+        )
+    
+    def create_vectorstore(
+        self,
+        documents: List[Document],
+        collection_name: Optional[str] = None
+    ) -> Chroma:
         """
         创建向量存储
         
         将文档转换为向量并存储在 Chroma 数据库中。
+        如果持久化的集合由相同的文档建立，则直接复用，不再重新嵌入；
+        文档有变化时删除旧集合并重建，避免检索到过期内容。
         
         参数:
             documents: 要存储的文档列表
+            collection_name: 集合名称，默认使用 self.collection_name
             
         返回:
             Chroma 向量存储实例
         """
         print("正在创建向量存储...")
         
-        # 使用 Chroma 创建向量存储
-        # Chroma 是一个轻量级的向量数据库，适合开发和小规模应用
-        self.vectorstore = Chroma.from_documents(
-            documents=documents,
-            collection_name=self.collection_name,
-            embedding=self.embedding_model,
-        )
+        collection_name = collection_name or self.collection_name
+        digest = self._documents_digest(documents)
+        
+        self.vectorstore = self._open_collection(collection_name, digest)
+        if (self.vectorstore._collection.metadata or {}).get("documents_digest") != digest:
+            # 集合由其他文档建立（或建立时未记录摘要），删除后重建
+            if self.vectorstore._collection.count() > 0:
+                print("文档已变化，重建向量存储")
+            self.vectorstore.delete_collection()
+            self.vectorstore = self._open_collection(collection_name, digest)
+        
+        if self.vectorstore._collection.count() == 0:
+            self._add_documents_batched(documents)
+            print(f"向量存储创建完成，包含 {len(documents)} 个文档块")
+        else:
+            print("复用已持久化的向量存储")
         
         # 创建检索器接口
-        self.retriever = self.vectorstore.as_retriever()
+        self.retriever = self._make_retriever()
         
-        print(f"向量存储创建完成，包含 {len(documents)} 个文档块")
         return self.vectorstore
     
     def setup_from_urls(self, urls: List[str]):
@@ -127,10 +370,14 @@ class VectorStoreManager:
         从 URL 列表完整设置向量存储
         
         这是一个便捷方法，执行完整的索引创建流程。
+        文档每次都会重新加载和分割，以便发现网页内容的变化；
+        若持久化的索引由相同内容建立，create_vectorstore 会跳过嵌入直接复用。
         
         参数:
             urls: 要索引的网页 URL 列表
         """
+        collection_name = self._collection_name_for(urls)
+        
         # 1. 加载文档
         documents = self.load_documents_from_urls(urls)
         
@@ -138,7 +385,7 @@ class VectorStoreManager:
         doc_splits = self.split_documents(documents)
         
         # 3. 创建向量存储
-        self.create_vectorstore(doc_splits)
+        self.create_vectorstore(doc_splits, collection_name=collection_name)
         
         print("向量存储设置完成！")
     
@@ -0,0 +1,94 @@
+"""
+语义缓存模块
+
+这个模块在工作流前面加一层语义缓存。
+换一种说法问同一个问题时（如 "agent memory types" 与
+"what memory types do agents have"），直接返回之前的答案，
+不必再执行检索和多次 LLM 调用。
+"""
+
+import json
+import uuid
+from typing import Any, Dict, Optional
+
+from langchain_community.vectorstores import Chroma
+from langchain_core.embeddings import Embeddings
+
+from config import get_config
+
+
+class SemanticCache:
+    """
+    基于问题嵌入的语义缓存
+    
+    使用一个独立的 Chroma 集合（余弦距离）保存
+    问题嵌入 -> 最终答案 的映射，按相似度查找。
+    """
+    
+    def __init__(
+        self,
+        embedding_model: Embeddings,
+        collection_name: str = "semantic-cache",
+        threshold: Optional[float] = None
+    ):
+        """
+        初始化语义缓存
+        
+        参数:
+            embedding_model: 用于嵌入问题的模型
+            collection_name: 缓存使用的 Chroma 集合名称
+            threshold: 命中所需的最低余弦相似度，默认使用 Config.SEMANTIC_CACHE_THRESHOLD
+        """
+        self.threshold = threshold if threshold is not None else get_config().SEMANTIC_CACHE_THRESHOLD
+        self.store = Chroma(
+            collection_name=collection_name,
+            embedding_function=embedding_model,
+            collection_metadata={"hnsw:space": "cosine"},
+        )
+    
+    def lookup(self, question: str) -> Optional[Dict[str, Any]]:
+        """
+        查找语义相近问题的缓存结果
+        
+        参数:
+            question: 用户问题
+        
+        返回:
+            缓存的结果字典，未命中时返回 None
+        """
+        if self.store._collection.count() == 0:
+            return None
+        
+        matches = self.store.similarity_search_with_relevance_scores(question, k=1)
+        if not matches:
+            return None
+        
+        doc, score = matches[0]
+        if score < self.threshold:
+            return None
+        
+        print(f"---语义缓存命中（相似度 {score:.3f}）: {doc.page_content}---")
+        result = json.loads(doc.metadata["result"])
+        result["question"] = question
+        return result
+    
+    def insert(self, question: str, final_state: Dict[str, Any]):
+        """
+        缓存一次运行的结果
+        
+        只保存问题和答案：文档对象无法直接序列化，命中时也不需要。
+        
+        参数:
+            question: 用户问题
+            final_state: 工作流的最终状态
+        """
+        generation = final_state.get("generation") if final_state else None
+        if not generation:
+            return
+        
+        result = json.dumps({"question": question, "generation": generation}, ensure_ascii=False)
+        self.store.add_texts(
+            [question],
+            metadatas=[{"result": result}],
+            ids=[str(uuid.uuid4())]
+        )
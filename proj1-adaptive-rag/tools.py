@@ -33,7 +33,9 @@ class WebSearchTool:
         self.k = k
         # Tavily 是专门为 AI 应用设计的搜索 API
         # 它返回的结果已经过优化，适合 LLM 处理
-        self.search_tool = TavilySearchResults(k=k)
+        # 结果数量由 max_results 控制（TavilySearchResults 没有 k 参数）
+        # 客户端只创建一次，后续调用复用同一个实例
+        self.search_tool = TavilySearchResults(max_results=k)
     
     def search(self, query: str) -> Document:
         """
@@ -49,7 +51,33 @@ class WebSearchTool:
         
         # 调用 Tavily API 进行搜索
         results = self.search_tool.invoke({"query": query})
+        return self._to_document(results)
+    
+    async def asearch(self, query: str) -> Document:
+        """
+        执行网络搜索（异步版本）
+        
+        参数:
+            query: 搜索查询
+            
+        返回:
+            包含搜索结果的 Document 对象
+        """
+        print(f"正在搜索网络: {query}")
         
+        results = await self.search_tool.ainvoke({"query": query})
+        return self._to_document(results)
+    
+    def _to_document(self, results: List[Dict[str, Any]]) -> Document:
+        """
+        将搜索结果封装为 Document
+        
+        参数:
+            results: 原始搜索结果
+            
+        返回:
+            包含格式化结果的 Document 对象
+        """
         # 格式化搜索结果
         formatted_results = self._format_results(results)
         
@@ -103,7 +131,8 @@ class WebSearchTool:
             new_k: 新的结果数量
         """
         self.k = new_k
-        self.search_tool = TavilySearchResults(k=new_k)
+        # 直接修改已有客户端的参数，无需重新创建
+        self.search_tool.max_results = new_k
 
 
 class ToolManager:
@@ -147,6 +176,18 @@ class ToolManager:
         """
         return self.web_search.search(query)
     
+    async def asearch_web(self, query: str) -> Document:
+        """
+        便捷方法：执行网络搜索（异步版本）
+        
+        参数:
+            query: 搜索查询
+            
+        返回:
+            搜索结果文档
+        """
+        return await self.web_search.asearch(query)
+    
     def list_available_tools(self) -> List[str]:
         """
         列出所有可用的工具
@@ -11,17 +11,61 @@ LangGraph 核心概念：
 - compile() 创建可执行的应用
 """
 
-from typing import Dict, Any, Optional
+import asyncio
+import logging
+import sys
+from typing import Dict, Any, List, Optional
+from uuid import UUID
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import END, StateGraph, START
 
+from config import get_config
 from models import GraphState
 from graph_nodes import GraphNodes
 from graph_edges import GraphEdges
 from llm_components import LLMComponents
 from retriever import VectorStoreManager
+from semantic_cache import SemanticCache
 from tools import ToolManager
 
 
+logger = logging.getLogger("adaptive_rag")
+
+
+class ExecutionTracer(BaseCallbackHandler):
+    """
+    执行轨迹回调
+    
+    在图运行过程中记录每个节点的精简信息（节点名、问题、是否有文档/答案），
+    代替逐步流式输出完整状态来构建轨迹。
+    """
+    
+    def __init__(self):
+        self.trace: List[Dict[str, Any]] = []
+        # 运行中的节点：run_id -> 节点名
+        self._node_runs: Dict[UUID, str] = {}
+    
+    def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, **kwargs):
+        # 只记录图节点本身，忽略节点内部的链调用
+        node = (metadata or {}).get("langgraph_node")
+        if node is not None and kwargs.get("name") == node:
+            self._node_runs[run_id] = node
+    
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        node = self._node_runs.pop(run_id, None)
+        if node is None or not isinstance(outputs, dict):
+            return
+        documents = outputs.get("documents") or []
+        self.trace.append({
+            "node": node,
+            "question": outputs.get("question"),
+            "has_documents": bool(documents),
+            "num_documents": len(documents),
+            "has_generation": bool(outputs.get("generation"))
+        })
+
+
 class AdaptiveRAGWorkflow:
     """
     自适应 RAG 工作流
@@ -54,7 +98,9 @@ class AdaptiveRAGWorkflow:
         """
         # 初始化组件，如果未提供则创建默认实例
         self.vector_store_manager = vector_store_manager or VectorStoreManager()
-        self.llm_components = llm_components or LLMComponents()
+        self.llm_components = llm_components or LLMComponents(
+            embedding_model=self.vector_store_manager.embedding_model
+        )
         self.tool_manager = tool_manager or ToolManager()
         
         # 获取检索器
@@ -69,6 +115,9 @@ class AdaptiveRAGWorkflow:
         
         self.edges = GraphEdges(llm_components=self.llm_components)
         
+        # 语义缓存：相近的问题直接复用之前的答案
+        self.semantic_cache = SemanticCache(self.vector_store_manager.embedding_model)
+        
         # 编译后的应用
         self.app = None
     
@@ -97,19 +146,49 @@ class AdaptiveRAGWorkflow:
         # 每个节点执行特定的任务
         
         # 网络搜索节点
-        workflow.add_node("web_search", self.nodes.web_search)
+        workflow.add_node(
+            "web_search",
+            RunnableLambda(self.nodes.web_search, afunc=self.nodes.aweb_search)
+        )
         
-        # 文档检索节点
-        workflow.add_node("retrieve", self.nodes.retrieve)
+        # 文档检索节点（异步运行时会并发检索原始问题和重写问题）
+        workflow.add_node(
+            "retrieve",
+            RunnableLambda(self.nodes.retrieve, afunc=self.nodes.aretrieve)
+        )
         
-        # 文档评分节点
-        workflow.add_node("grade_documents", self.nodes.grade_documents)
+        # 低置信度路由：同时检索向量存储和网络搜索
+        workflow.add_node(
+            "retrieve_and_search",
+            RunnableLambda(
+                self.nodes.retrieve_and_search,
+                afunc=self.nodes.aretrieve_and_search
+            )
+        )
+        
+        # 文档评分节点（同步/异步两种实现，异步运行时并发评分）
+        workflow.add_node(
+            "grade_documents",
+            RunnableLambda(
+                self.nodes.grade_documents,
+                afunc=self.nodes.agrade_documents
+            )
+        )
         
         # 答案生成节点
-        workflow.add_node("generate", self.nodes.generate)
+        workflow.add_node(
+            "generate",
+            RunnableLambda(self.nodes.generate, afunc=self.nodes.agenerate)
+        )
         
         # 查询转换节点
-        workflow.add_node("transform_query", self.nodes.transform_query)
+        workflow.add_node(
+            "transform_query",
+            RunnableLambda(self.nodes.transform_query, afunc=self.nodes.atransform_query)
+        )
+        
+        # 重写次数达到上限时的收尾节点（标记答案未通过质量检查）
+        workflow.add_node("max_retries", self.nodes.max_retries)
         
         # ===== 构建图结构 =====
         
@@ -121,6 +200,7 @@ class AdaptiveRAGWorkflow:
             {
                 "web_search": "web_search",  # 如果返回 "web_search"，去网络搜索节点
                 "vectorstore": "retrieve",   # 如果返回 "vectorstore"，去检索节点
+                "both": "retrieve_and_search",  # 置信度低，两个数据源同时检索
             },
         )
         
@@ -129,6 +209,7 @@ class AdaptiveRAGWorkflow:
         
         # 3. 检索后进行文档评分
         workflow.add_edge("retrieve", "grade_documents")
+        workflow.add_edge("retrieve_and_search", "grade_documents")
         
         # 4. 文档评分后的条件路由
         workflow.add_conditional_edges(
@@ -146,13 +227,18 @@ class AdaptiveRAGWorkflow:
         # 6. 生成答案后的质量控制
         workflow.add_conditional_edges(
             "generate",
-            self.edges.grade_generation_v_documents_and_question,
+            RunnableLambda(
+                self.edges.grade_generation_v_documents_and_question,
+                afunc=self.edges.agrade_generation_v_documents_and_question
+            ),
             {
                 "not supported": "generate",      # 有幻觉，重新生成
                 "useful": END,                     # 答案好，结束
                 "not useful": "transform_query",   # 答案不好，转换查询
+                "max retries": "max_retries",      # 重写次数已达上限，返回当前答案
             },
         )
+        workflow.add_edge("max_retries", END)
         
         print("工作流构建完成！")
         return workflow
@@ -176,14 +262,33 @@ class AdaptiveRAGWorkflow:
             print("工作流编译成功！")
         return self.app
     
-    def run(self, question: str) -> Dict[str, Any]:
+    def run(self, question: str, stream_tokens: bool = False) -> Dict[str, Any]:
         """
         运行工作流
         
         执行完整的 RAG 流程。
+        内部通过 asyncio.run 驱动异步运行时，节点的异步实现
+        （并发检索、并发评分、异步网络搜索和生成）都会生效。
         
         参数:
             question: 用户问题
+            stream_tokens: 是否将生成节点的 token 实时输出到标准输出
+            
+        返回:
+            包含答案的结果字典
+        """
+        return asyncio.run(self.arun(question, stream_tokens=stream_tokens))
+    
+    async def arun(self, question: str, stream_tokens: bool = False) -> Dict[str, Any]:
+        """
+        异步运行工作流
+        
+        使用 LangGraph 的异步运行时，节点的异步实现
+        （如并发文档评分）会在这里生效。
+        
+        参数:
+            question: 用户问题
+            stream_tokens: 是否将生成节点的 token 实时输出到标准输出
             
         返回:
             包含答案的结果字典
@@ -192,31 +297,127 @@ class AdaptiveRAGWorkflow:
         if self.app is None:
             self.compile()
         
-        # 准备输入
+        # 语义相近的问题直接返回缓存的答案
+        # 查询和写入缓存需要嵌入请求，放到线程中执行，不阻塞事件循环
+        cached = await asyncio.to_thread(self.semantic_cache.lookup, question)
+        if cached is not None:
+            if stream_tokens:
+                print(f"\n答案:\n{cached['generation']}")
+            return cached
+        
+        # 准备输入（评分、检索缓存随图状态传递，每次运行从空开始）
         inputs = {"question": question}
         
         print(f"\n{'='*50}")
         print(f"处理问题: {question}")
         print(f"{'='*50}\n")
         
-        # 运行工作流并收集结果
-        final_state = None
-        for output in self.app.stream(inputs):
-            for key, value in output.items():
-                print(f"\n节点 '{key}' 执行完成")
-                final_state = value
+        if stream_tokens:
+            final_state = await self._astream_tokens(inputs)
+        else:
+            # 运行工作流并收集结果
+            final_state = None
+            async for output in self.app.astream(inputs):
+                for key, value in output.items():
+                    print(f"\n节点 '{key}' 执行完成")
+                    final_state = value
+        
+        # 只缓存通过质量检查的完整答案：重写次数耗尽或被提前终止的答案不能复用
+        if (
+            final_state
+            and not final_state.get("retries_exhausted")
+            and not final_state.get("generation_aborted")
+        ):
+            await asyncio.to_thread(self.semantic_cache.insert, question, final_state)
         
         # 返回最终状态
         return final_state
     
-    def run_with_details(self, question: str) -> Dict[str, Any]:
+    async def _astream_tokens(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        以 token 流的方式运行工作流
+        
+        同时订阅 "messages"、"updates" 和 "values" 三种流：
+        "messages" 只输出生成节点的 token（评分器等结构化输出不显示），
+        "updates" 用于记录最后执行的节点，"values" 用于拿到最终状态。
+        重新生成时另起一行；最终答案不是由生成节点给出时（如重试次数耗尽），
+        在结束时直接打印最终状态中的答案。
+        
+        参数:
+            inputs: 工作流输入
+            
+        返回:
+            最终状态
+        """
+        final_state = None
+        current_step = None
+        last_node = None
+        
+        async for mode, payload in self.app.astream(inputs, stream_mode=["messages", "updates", "values"]):
+            if mode == "values":
+                final_state = payload
+                continue
+            if mode == "updates":
+                last_node = next(iter(payload), last_node)
+                continue
+            
+            chunk, metadata = payload
+            if metadata.get("langgraph_node") != "generate" or not chunk.content:
+                continue
+            
+            if metadata.get("langgraph_step") != current_step:
+                current_step = metadata.get("langgraph_step")
+                sys.stdout.write("\n答案:\n")
+            sys.stdout.write(chunk.content)
+            sys.stdout.flush()
+        
+        if last_node != "generate" and final_state and final_state.get("generation"):
+            sys.stdout.write(f"\n答案:\n{final_state['generation']}")
+        sys.stdout.write("\n")
+        return final_state
+    
+    def run_batch(
+        self,
+        questions: List[str],
+        max_concurrency: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        批量运行工作流
+        
+        使用编译后应用的 batch() 并发处理多个问题，
+        每个问题的 LLM 调用不再阻塞其他问题。
+        
+        参数:
+            questions: 问题列表
+            max_concurrency: 最大并发数，默认使用 Config.MAX_CONCURRENCY
+            
+        返回:
+            与问题顺序一致的最终状态列表
+        """
+        # 确保应用已编译
+        if self.app is None:
+            self.compile()
+        
+        if max_concurrency is None:
+            max_concurrency = get_config().MAX_CONCURRENCY
+        
+        # 评分、检索缓存保存在各自的图状态中，并发运行的问题互不影响
+        inputs = [{"question": question} for question in questions]
+        
+        print(f"\n批量处理 {len(questions)} 个问题（并发数 {max_concurrency}）...")
+        
+        return self.app.batch(inputs, config={"max_concurrency": max_concurrency})
+    
+    def run_with_details(self, question: str, collect_trace: Optional[bool] = None) -> Dict[str, Any]:
         """
         运行工作流并返回详细信息
         
         提供更详细的执行过程信息。
+        执行轨迹只在需要时收集，节点信息以 DEBUG 级别记录。
         
         参数:
             question: 用户问题
+            collect_trace: 是否收集执行轨迹，默认使用 Config.VERBOSE
             
         返回:
             包含详细执行信息的结果
@@ -225,37 +426,30 @@ class AdaptiveRAGWorkflow:
         if self.app is None:
             self.compile()
         
-        # 准备输入
-        inputs = {"question": question}
-        
-        # 收集执行轨迹
-        execution_trace = []
-        final_state = None
+        if collect_trace is None:
+            collect_trace = get_config().VERBOSE
         
-        print(f"\n{'='*50}")
-        print(f"详细执行追踪")
-        print(f"问题: {question}")
-        print(f"{'='*50}\n")
+        # 准备输入（评分、检索缓存随图状态传递，每次运行从空开始）
+        inputs = {"question": question}
         
-        for output in self.app.stream(inputs):
-            for node_name, node_state in output.items():
-                # 记录执行轨迹
-                trace_entry = {
-                    "node": node_name,
-                    "question": node_state.get("question"),
-                    "has_documents": bool(node_state.get("documents")),
-                    "has_generation": bool(node_state.get("generation"))
-                }
-                execution_trace.append(trace_entry)
-                
-                # 打印节点信息
-                print(f"\n--- 节点: {node_name} ---")
-                if node_state.get("generation"):
-                    print(f"生成了答案")
-                if node_state.get("documents"):
-                    print(f"文档数量: {len(node_state.get('documents', []))}")
-                
-                final_state = node_state
+        logger.debug("\n%s\n详细执行追踪\n问题: %s\n%s\n", "=" * 50, question, "=" * 50)
+        
+        if collect_trace:
+            # 通过回调在图内部记录精简的执行轨迹，不需要逐步物化完整状态
+            tracer = ExecutionTracer()
+            final_state = self.app.invoke(inputs, config={"callbacks": [tracer]})
+            execution_trace = tracer.trace
+        else:
+            final_state = self.app.invoke(inputs)
+            execution_trace = []
+        
+        # 记录节点信息
+        if logger.isEnabledFor(logging.DEBUG):
+            for entry in execution_trace:
+                logger.debug(
+                    "\n--- 节点: %s ---\n生成了答案: %s\n文档数量: %d",
+                    entry["node"], entry["has_generation"], entry["num_documents"]
+                )
         
         # 构建详细结果
         result = {
@@ -265,18 +459,17 @@ class AdaptiveRAGWorkflow:
             "final_state": final_state
         }
         
-        print(f"\n{'='*50}")
-        print("执行完成！")
-        print(f"最终答案: {result['answer'][:100]}...")
-        print(f"{'='*50}\n")
+        logger.debug("\n%s\n执行完成！\n最终答案: %.100s...\n%s\n", "=" * 50, result["answer"], "=" * 50)
         
         return result
     
-    def visualize_graph(self) -> str:
+    @staticmethod
+    def visualize_graph() -> str:
         """
         生成图结构的文本表示
         
         用于理解工作流结构。
+        这是静态描述，无需创建工作流实例（也就无需 API 密钥）。
         
         返回:
             图结构的文本描述
@@ -316,6 +509,7 @@ class AdaptiveRAGWorkflow:
         节点说明:
         - 路由问题: 决定使用网络搜索还是向量存储
         - 网络搜索: 搜索最新的网络信息
+        - 置信度较低时: 同时检索文档和搜索网络，合并后评分
         - 检索文档: 从向量存储检索相关文档
         - 评分文档: 评估文档相关性
         - 转换查询: 重写问题以改善检索
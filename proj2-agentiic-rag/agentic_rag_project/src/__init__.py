@@ -4,12 +4,33 @@ Agentic RAG System
 一个基于 LangGraph 的智能检索增强生成系统
 """
 
-from .main import AgenticRAGSystem
+import importlib
+
 from .config import config
-from .vector_store import vector_store_manager
-from .tools import tools_manager
-from .workflow import workflow_builder
-from .nodes import agent_nodes
+
+# 其余模块会引入 LangChain、Chroma、OpenAI SDK 等较重的依赖，
+# 按需在首次访问时导入（PEP 562），只用到 config 的脚本无需承担这部分启动开销
+_LAZY_ATTRS = {
+    "AgenticRAGSystem": "main",
+    "vector_store_manager": "vector_store",
+    "tools_manager": "tools",
+    "workflow_builder": "workflow",
+    "agent_nodes": "nodes",
+}
+
+
+def __getattr__(name):
+    """首次访问时从对应子模块导入属性"""
+    module_name = _LAZY_ATTRS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module_name}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY_ATTRS))
 
 __version__ = "1.0.0"
 __author__ = "Agentic RAG Team"
@@ -19,25 +19,63 @@ class Config:
 
     # 模型配置 - 所有模型统一使用 gpt-5-mini
     AGENT_MODEL: str = "gpt-5-mini"
-    GRADER_MODEL: str = "gpt-5-mini"
+    GRADER_MODEL: str = "gpt-4o-mini"  # 评分只需输出 yes/no，使用更小更快的模型
     REWRITER_MODEL: str = "gpt-5-mini"
     GENERATOR_MODEL: str = "gpt-5-mini"
 
+    # 文档评分方式："llm"（单 token 的 LLM 评分）或 "embedding"（本地余弦相似度，不调用 LLM）
+    GRADER_BACKEND: str = "llm"
+    GRADER_SIMILARITY_THRESHOLD: float = 0.35
+    GRADER_MAX_CONTEXT_CHARS: int = 6000  # 评分时传入的文档文本上限，限制每次调用的提示 token 数
+
     # 温度参数
     DEFAULT_TEMPERATURE: float = 0.0
     
     # 流式输出
     STREAMING: bool = False
     
+    # 设置环境变量 RAG_FULL_TRACE 时打印每个节点的完整输出，否则只打印一行摘要
+    FULL_TRACE: bool = bool(os.getenv("RAG_FULL_TRACE"))
+    
+    # agentic_rag 日志级别：默认只输出警告，设为 INFO/DEBUG 可查看初始化过程和节点追踪
+    LOG_LEVEL: str = os.getenv("RAG_LOG_LEVEL", "WARNING")
+    
+    # 批量查询的最大并发数
+    MAX_CONCURRENCY: int = 8
+    
+    # 将文档相关性评估与答案生成合并为一次 LLM 调用
+    FUSE_GRADE_AND_GENERATE: bool = True
+    
+    # 只有检索一个工具时跳过代理模型的决策调用，直接检索
+    SKIP_AGENT_DECISION: bool = True
+    
     # 文档源配置
     BLOG_URLS: List[str] = None
     
     # 文本分割参数
     CHUNK_SIZE: int = 100
     CHUNK_OVERLAP: int = 50
+    TOKEN_ENCODING: str = "cl100k_base"  # 按 token 分块使用的 tiktoken 编码（与 OpenAI 嵌入模型一致）
+    
+    # 嵌入参数：每次嵌入 API 请求包含的文本数量
+    EMBEDDING_BATCH_SIZE: int = 1000
+    QUERY_EMBEDDING_CACHE_SIZE: int = 2048  # 查询向量 LRU 缓存容量
     
     # 向量数据库配置
     COLLECTION_NAME: str = "rag-chroma"
+    VECTOR_STORE_BACKEND: str = os.getenv("VECTOR_STORE_BACKEND", "faiss")  # "faiss"、"chroma" 或 "numpy"
+    VECTOR_STORE_DIR: str = ".vectorstore"  # 索引持久化目录
+    # FAISS 索引结构（faiss.index_factory 描述串）："Flat" 为精确搜索；
+    # 大语料可用 "IVF256,PQ48x8,RFlat"（PQ 压缩 + FP32 重排）或 "HNSW32,SQfp16"
+    FAISS_INDEX_FACTORY: str = os.getenv("FAISS_INDEX_FACTORY", "Flat")
+    FAISS_NPROBE: int = 8  # IVF 索引每次查询探测的聚类数
+    FAISS_REFINE_K_FACTOR: int = 8  # RFlat 重排候选数 = k * 该系数
+    
+    # 语义缓存配置
+    SEMANTIC_CACHE_ENABLED: bool = True
+    SEMANTIC_CACHE_COLLECTION: str = "llm_response_cache"
+    SEMANTIC_CACHE_MAX_DISTANCE: float = 0.15  # 命中所需的最大余弦距离
+    SEMANTIC_CACHE_TTL: int = 24 * 3600  # 缓存条目有效期（秒）
     
     # 检索工具配置
     RETRIEVER_TOOL_NAME: str = "retrieve_blog_posts"
@@ -0,0 +1,77 @@
+"""日志配置模块 - 节点追踪等日志经队列交给后台线程输出"""
+
+import atexit
+import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+LOGGER_NAME = "agentic_rag"
+
+_listener: Optional[QueueListener] = None
+
+
+class _RingBufferQueueHandler(QueueHandler):
+    """队列满时丢弃最旧的记录，写日志永不阻塞调用方"""
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        while True:
+            try:
+                self.queue.put_nowait(record)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+
+class _RingBufferQueueListener(QueueListener):
+    """停止时阻塞等待放入结束标记（队列满时 put_nowait 会失败）"""
+
+    def enqueue_sentinel(self) -> None:
+        self.queue.put(self._sentinel)
+
+
+def setup_logging(level: str = "WARNING", capacity: int = 10000) -> QueueListener:
+    """
+    配置 agentic_rag 日志器（重复调用只更新日志级别）
+
+    调用方（节点、批量查询的协程）只把记录放入内存队列，
+    格式化和写 stdout 都在 QueueListener 的后台线程中完成；
+    进程退出时自动停止后台线程并输出剩余记录。
+
+    Args:
+        level: 日志级别名称，如 "WARNING"、"INFO"、"DEBUG"
+        capacity: 队列容量，超出时丢弃最旧的记录
+
+    Returns:
+        正在运行的 QueueListener
+    """
+    global _listener
+
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(level.upper())
+    if _listener is not None:
+        return _listener
+
+    log_queue = queue.Queue(maxsize=capacity)
+    logger.addHandler(_RingBufferQueueHandler(log_queue))
+    logger.propagate = False
+
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    _listener = _RingBufferQueueListener(log_queue, handler)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging() -> None:
+    """停止后台线程，并输出队列中剩余的记录"""
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,29 +1,47 @@
 """主程序入口 - Agentic RAG 系统"""
 
+import asyncio
+import logging
 import os
 import sys
 import pprint
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+from langchain_core.utils.json import parse_partial_json
 from .config import config
 from .vector_store import vector_store_manager
 from .tools import tools_manager
 from .workflow import workflow_builder
+from .nodes import aclose_http_client
+from .semantic_cache import SemanticCache
+from .logging_setup import setup_logging
+
+logger = logging.getLogger("agentic_rag")
 
 
 class AgenticRAGSystem:
     """Agentic RAG 系统主类"""
     
-    def __init__(self):
-        """初始化系统"""
+    def __init__(self, checkpointer=None):
+        """
+        初始化系统
+        
+        Args:
+            checkpointer: LangGraph 检查点存储（可选）；传入后查询可指定 thread_id，
+                中断的运行可用同一 thread_id 恢复
+        """
         self.config = config
+        self.checkpointer = checkpointer
         self.vector_store = vector_store_manager
         self.tools = tools_manager
         self.workflow_builder = workflow_builder
+        self.semantic_cache = None
         self.graph = None
         self.initialized = False
     
     def initialize(self):
         """完整系统初始化"""
+        setup_logging(self.config.LOG_LEVEL)
+        
         print("=" * 60)
         print("🚀 Agentic RAG 系统启动")
         print("=" * 60)
@@ -39,6 +57,10 @@ class AgenticRAGSystem:
             self.vector_store.initialize()
             print("   ✓ 向量存储初始化完成")
             
+            # 语义缓存与向量存储共用嵌入模型
+            if self.config.SEMANTIC_CACHE_ENABLED:
+                self.semantic_cache = SemanticCache(self.vector_store.embeddings)
+            
             # 3. 初始化工具
             print("3. 初始化工具...")
             self.tools.initialize()
@@ -46,7 +68,7 @@ class AgenticRAGSystem:
             
             # 4. 构建工作流
             print("4. 构建工作流...")
-            self.graph = self.workflow_builder.initialize()
+            self.graph = self.workflow_builder.initialize(self.checkpointer)
             print("   ✓ 工作流构建完成")
             
             self.initialized = True
@@ -58,13 +80,22 @@ class AgenticRAGSystem:
             print(f"\n❌ 系统初始化失败: {e}")
             sys.exit(1)
     
-    def query(self, question: str, verbose: bool = True) -> str:
+    def query(
+        self,
+        question: str,
+        verbose: bool = True,
+        stream_tokens: bool = False,
+        thread_id: Optional[str] = None
+    ) -> str:
         """
         处理用户查询
         
         Args:
             question: 用户问题
             verbose: 是否显示详细过程
+            stream_tokens: 是否将答案逐 token 打印到终端
+            thread_id: 检查点线程 ID（需要创建系统时传入 checkpointer）；
+                该线程上次运行被中断时从中断处继续
             
         Returns:
             最终答案
@@ -77,6 +108,16 @@ class AgenticRAGSystem:
             print(f"🔍 处理查询: {question}")
             print("=" * 50)
         
+        # 语义相近的问题直接返回缓存的答案（缓存内部按规范化问题查找，
+        # 工作流和模型始终收到用户的原始问题，保留大小写）
+        if self.semantic_cache is not None:
+            cached = self.semantic_cache.lookup(question)
+            if cached is not None:
+                if stream_tokens:
+                    self._print_answer_header()
+                    print(cached)
+                return cached
+        
         # 构建输入
         inputs = {
             "messages": [
@@ -85,24 +126,194 @@ class AgenticRAGSystem:
         }
         
         final_answer = None
+        run_config = self._run_config(thread_id)
+        if run_config is not None and self.graph.get_state(run_config).next:
+            inputs = None  # 从中断处继续
         
-        # 执行工作流
-        for output in self.graph.stream(inputs):
-            for key, value in output.items():
-                if verbose:
-                    print(f"\n📍 节点输出 '{key}':")
-                    print("-" * 30)
-                    pprint.pprint(value, indent=2, width=80, depth=None)
+        # 执行工作流：只接收每个节点的增量更新，生成答案后立即停止
+        if not stream_tokens:
+            for output in self.graph.stream(inputs, stream_mode="updates", config=run_config):
+                final_answer = self._handle_update(output, verbose)
+                if final_answer is not None:
+                    break
+        else:
+            # 同时订阅 LLM token，答案边生成边打印
+            streamed = []
+            buffers = {}
+            for mode, payload in self.graph.stream(
+                inputs, stream_mode=["updates", "messages"], config=run_config
+            ):
+                if mode == "messages":
+                    text = self._answer_delta(*payload, buffers)
+                    if text:
+                        if not streamed:
+                            self._print_answer_header()
+                        streamed.append(text)
+                        sys.stdout.write(text)
+                        sys.stdout.flush()
+                    continue
                 
-                # 保存最终答案（严格按照原始 notebook 逻辑）
-                if key == "generate" and "messages" in value:
-                    final_answer = value["messages"][0]
+                final_answer = self._handle_update(payload, verbose and not streamed)
+                if final_answer is not None:
+                    break
+            if streamed:
+                print()
+                final_answer = final_answer or "".join(streamed)
+            else:
+                # 模型未逐 token 输出时，一次性打印完整答案
+                self._print_answer_header()
+                print(final_answer if final_answer else "未能生成答案")
         
         if verbose:
             print("\n" + "=" * 50)
             print("✅ 查询处理完成")
             print("=" * 50)
         
+        if final_answer and self.semantic_cache is not None:
+            self.semantic_cache.insert(question, final_answer)
+        
+        return final_answer if final_answer else "未能生成答案"
+    
+    def _run_config(self, thread_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        """
+        构建检查点线程配置
+        
+        Args:
+            thread_id: 检查点线程 ID，为 None 时不使用检查点
+            
+        Returns:
+            运行配置；未指定 thread_id 时返回 None
+        """
+        if thread_id is None:
+            return None
+        if self.checkpointer is None:
+            raise ValueError("指定 thread_id 需要在创建 AgenticRAGSystem 时传入 checkpointer")
+        return {"configurable": {"thread_id": thread_id}}
+    
+    @staticmethod
+    def _summarize_update(value: Any) -> str:
+        """节点更新的一行摘要：最后一条消息的类型和长度"""
+        messages = value.get("messages") if isinstance(value, dict) else None
+        if not messages:
+            return repr(value)
+        last = messages[-1]
+        content = getattr(last, "content", last)
+        return f"{type(last).__name__} len={len(content)}"
+    
+    @classmethod
+    def _handle_update(cls, output: Dict[str, Any], verbose: bool):
+        """
+        处理一次节点增量更新
+        
+        Args:
+            output: 节点名 -> 该节点返回的更新
+            verbose: 是否打印节点输出
+            
+        Returns:
+            生成节点给出的答案；其他节点返回 None
+        """
+        final_answer = None
+        for key, value in output.items():
+            if verbose and config.FULL_TRACE:
+                print(f"\n📍 节点输出 '{key}':")
+                print("-" * 30)
+                pprint.pprint(value, indent=2, width=80, depth=None)
+            elif verbose:
+                print(f"📍 {key}: {cls._summarize_update(value)}")
+            
+            # 保存最终答案（严格按照原始 notebook 逻辑；合并节点相关时同样给出答案）
+            if key in ("generate", "grade_and_generate") and value.get("messages"):
+                final_answer = value["messages"][0]
+        return final_answer
+    
+    @staticmethod
+    def _print_answer_header():
+        print("\n🎯 最终答案:")
+        print("-" * 20)
+    
+    @staticmethod
+    def _answer_delta(chunk, metadata: Dict[str, Any], buffers: Dict[Any, str]) -> str:
+        """
+        从一个 LLM token 中取出新增的答案文本
+        
+        generate 节点直接输出答案文本；合并节点输出的是结构化 JSON，
+        需要累积后按部分 JSON 解析出 answer 字段，再返回新增的部分。
+        
+        Args:
+            chunk: LLM 输出的消息片段
+            metadata: 片段所属节点等元数据
+            buffers: 每次合并节点运行的累积输出（跨调用保存）
+            
+        Returns:
+            新增的答案文本；不属于答案的 token 返回空字符串
+        """
+        node = metadata.get("langgraph_node")
+        if node == "generate":
+            return chunk.content if isinstance(chunk.content, str) else ""
+        if node != "grade_and_generate":
+            return ""
+        
+        # 重写后合并节点会再次运行，按步骤分别累积
+        step = metadata.get("langgraph_step")
+        raw = buffers.get(step, "")
+        if isinstance(chunk.content, str):
+            raw += chunk.content
+        raw += "".join(tc.get("args") or "" for tc in getattr(chunk, "tool_call_chunks", []))
+        
+        printed = len(buffers.get((step, "answer"), ""))
+        buffers[step] = raw
+        parsed = parse_partial_json(raw) if raw else None
+        answer = parsed.get("answer") if isinstance(parsed, dict) else None
+        if not isinstance(answer, str) or not parsed.get("relevant"):
+            return ""
+        buffers[(step, "answer")] = answer
+        return answer[printed:]
+    
+    async def aquery(
+        self,
+        question: str,
+        verbose: bool = False,
+        thread_id: Optional[str] = None
+    ) -> str:
+        """
+        处理用户查询（异步版本）
+        
+        Args:
+            question: 用户问题
+            verbose: 是否显示详细过程
+            thread_id: 检查点线程 ID，含义同 query()
+            
+        Returns:
+            最终答案
+        """
+        if not self.initialized:
+            raise ValueError("系统尚未初始化，请先调用 initialize() 方法")
+        
+        if self.semantic_cache is not None:
+            # 查询缓存需要一次嵌入请求和一次 Chroma 查询，放到线程中执行，不阻塞事件循环
+            cached = await asyncio.to_thread(self.semantic_cache.lookup, question)
+            if cached is not None:
+                return cached
+        
+        inputs = {
+            "messages": [
+                ("user", question),
+            ]
+        }
+        
+        final_answer = None
+        run_config = self._run_config(thread_id)
+        if run_config is not None and (await self.graph.aget_state(run_config)).next:
+            inputs = None  # 从中断处继续
+        
+        async for output in self.graph.astream(inputs, stream_mode="updates", config=run_config):
+            final_answer = self._handle_update(output, verbose)
+            if final_answer is not None:
+                break
+        
+        if final_answer and self.semantic_cache is not None:
+            await asyncio.to_thread(self.semantic_cache.insert, question, final_answer)
+        
         return final_answer if final_answer else "未能生成答案"
     
     def interactive_mode(self):
@@ -123,12 +334,9 @@ class AgenticRAGSystem:
                     print("⚠️ 请输入有效问题")
                     continue
                 
-                # 处理查询
-                answer = self.query(question, verbose=True)
+                # 处理查询，答案生成时即逐 token 打印
+                self.query(question, verbose=True, stream_tokens=True)
                 
-                print(f"\n🎯 最终答案:")
-                print("-" * 20)
-                print(answer)
                 print("-" * 40)
                 
             except KeyboardInterrupt:
@@ -148,21 +356,54 @@ class AgenticRAGSystem:
         Returns:
             问题答案映射
         """
-        results = {}
+        async def run() -> Dict[str, str]:
+            try:
+                return await self.abatch_query(questions, verbose=verbose)
+            finally:
+                # 事件循环随 asyncio.run 结束，在此之前关闭它的连接池
+                await aclose_http_client()
         
-        print(f"\n📋 开始批量处理 {len(questions)} 个问题...")
+        return asyncio.run(run())
+    
+    async def abatch_query(self, questions: list, verbose: bool = False) -> Dict[str, str]:
+        """
+        批量处理查询（异步版本）
         
-        for i, question in enumerate(questions, 1):
-            print(f"\n[{i}/{len(questions)}] 处理问题: {question}")
-            try:
-                answer = self.query(question, verbose=verbose)
+        所有问题并发执行，并发数由 config.MAX_CONCURRENCY 限制。
+        
+        Args:
+            questions: 问题列表
+            verbose: 是否显示详细过程
+            
+        Returns:
+            问题答案映射
+        """
+        logger.info("📋 开始批量处理 %d 个问题（并发数 %d）...", len(questions), self.config.MAX_CONCURRENCY)
+        
+        semaphore = asyncio.Semaphore(self.config.MAX_CONCURRENCY)
+        
+        async def run_one(i: int, question: str) -> str:
+            async with semaphore:
+                logger.info("[%d/%d] 处理问题: %s", i, len(questions), question)
+                return await self.aquery(question, verbose=verbose)
+        
+        answers = await asyncio.gather(
+            *(run_one(i, q) for i, q in enumerate(questions, 1)),
+            return_exceptions=True
+        )
+        
+        results = {}
+        for question, answer in zip(questions, answers):
+            if isinstance(answer, Exception):
+                logger.warning("❌ 失败: %s: %s", question, answer)
+                results[question] = f"处理失败: {answer}"
+            else:
                 results[question] = answer
-                print(f"✓ 完成")
-            except Exception as e:
-                print(f"❌ 失败: {e}")
-                results[question] = f"处理失败: {e}"
         
-        print(f"\n📊 批量处理完成，成功处理 {len([r for r in results.values() if not r.startswith('处理失败')])} 个问题")
+        logger.info(
+            "📊 批量处理完成，成功处理 %d 个问题",
+            len([r for r in results.values() if not r.startswith('处理失败')])
+        )
         return results
 
 
@@ -1,19 +1,87 @@
 """节点函数模块 - 定义工作流中的所有节点"""
 
-from typing import Literal
+import asyncio
+import importlib.util
+import logging
+import uuid
+from functools import cached_property
+from typing import Dict, Literal, Optional
+import httpx
+import numpy as np
 from langchain import hub
-from langchain_core.messages import BaseMessage, HumanMessage
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.prompts import PromptTemplate
+from langchain_core.prompts import ChatPromptTemplate, PromptTemplate
 from langchain_core.pydantic_v1 import BaseModel, Field
 from langchain_openai import ChatOpenAI
 from .config import config
 from .tools import tools_manager
+from .vector_store import vector_store_manager
 
+logger = logging.getLogger("agentic_rag")
 
-class Grade(BaseModel):
-    """文档相关性评分模型"""
-    binary_score: str = Field(description="相关性评分 'yes' 或 'no'")
+
+# 所有模型共用一组连接池：并发调用复用已建立的 TLS 连接；
+# 安装了 h2 时启用 HTTP/2，多个请求在同一连接上多路复用
+_HTTP2 = importlib.util.find_spec("h2") is not None
+_HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+_http_client = httpx.Client(http2=_HTTP2, limits=_HTTP_LIMITS, timeout=60)
+
+
+class _PerLoopTransport(httpx.AsyncBaseTransport):
+    """
+    按事件循环分配连接池的异步传输层
+    
+    异步连接绑定在创建它的事件循环上；batch_query 每次调用 asyncio.run
+    都会新建事件循环，复用旧循环的连接会报 "Event loop is closed"。
+    这里为每个事件循环单独创建连接池，事件循环关闭后对应的连接池即被丢弃。
+    """
+    
+    def __init__(self, **kwargs):
+        self._transport_kwargs = kwargs
+        self._loop_transports: Dict[asyncio.AbstractEventLoop, httpx.AsyncHTTPTransport] = {}
+    
+    def _current_transport(self) -> httpx.AsyncHTTPTransport:
+        loop = asyncio.get_running_loop()
+        # 未显式关闭的事件循环（如直接 asyncio.run(aquery(...))）在这里清理
+        for closed in [l for l in self._loop_transports if l.is_closed()]:
+            del self._loop_transports[closed]
+        transport = self._loop_transports.get(loop)
+        if transport is None:
+            transport = self._loop_transports[loop] = httpx.AsyncHTTPTransport(**self._transport_kwargs)
+        return transport
+    
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self._current_transport().handle_async_request(request)
+    
+    async def aclose(self) -> None:
+        """关闭当前事件循环的连接池（在事件循环结束前调用）"""
+        transport = self._loop_transports.pop(asyncio.get_running_loop(), None)
+        if transport is not None:
+            await transport.aclose()
+
+
+_async_transport = _PerLoopTransport(http2=_HTTP2, limits=_HTTP_LIMITS)
+_http_async_client = httpx.AsyncClient(transport=_async_transport, timeout=60)
+
+
+async def aclose_http_client() -> None:
+    """关闭当前事件循环中共享的异步连接池"""
+    await _async_transport.aclose()
+
+
+def _chat_model(**kwargs) -> ChatOpenAI:
+    """创建使用共享 HTTP 连接池的 ChatOpenAI 实例"""
+    return ChatOpenAI(http_client=_http_client, http_async_client=_http_async_client, **kwargs)
+
+
+class GradedAnswer(BaseModel):
+    """文档相关性评估与答案生成的合并输出"""
+    relevant: bool = Field(description="检索到的文档是否与用户问题相关")
+    answer: Optional[str] = Field(
+        default=None,
+        description="文档相关时基于文档给出的答案，不相关时留空"
+    )
 
 
 class AgentNodes:
@@ -30,6 +98,21 @@ class AgentNodes:
             self.tools = tools_manager.get_tools()
         return self.tools
     
+    @cached_property
+    def rag_chain(self):
+        """
+        RAG 生成链（首次访问时构建，之后复用）
+        
+        从 hub 拉取提示模板只发生一次，避免每次生成都发起网络请求。
+        """
+        prompt = hub.pull(self.config.RAG_PROMPT_HUB)
+        llm = _chat_model(
+            model_name=self.config.GENERATOR_MODEL,  # 使用 gpt-5
+            temperature=self.config.DEFAULT_TEMPERATURE,
+            streaming=True  # 答案逐 token 输出，由调用方决定是否消费
+        )
+        return prompt | llm | StrOutputParser()
+    
     def agent(self, state):
         """
         代理节点：决定是否需要调用检索工具
@@ -40,22 +123,69 @@ class AgentNodes:
         Returns:
             dict: 更新后的状态
         """
-        print("---调用代理节点---")
+        logger.debug("---调用代理节点---")
+        direct = self._direct_retrieval(state)
+        if direct is not None:
+            return direct
+        
         messages = state["messages"]
         
-        # 创建绑定了工具的模型
-        model = ChatOpenAI(
+        # 调用绑定了工具的模型
+        response = self.agent_model.invoke(messages)
+        
+        # 返回更新后的消息列表
+        return {"messages": [response]}
+    
+    async def aagent(self, state):
+        """代理节点（异步版本）"""
+        logger.debug("---调用代理节点---")
+        direct = self._direct_retrieval(state)
+        if direct is not None:
+            return direct
+        
+        response = await self.agent_model.ainvoke(state["messages"])
+        return {"messages": [response]}
+    
+    def _direct_retrieval(self, state):
+        """
+        只注册了检索工具时直接构造检索调用，不调用代理模型
+        
+        检索查询取最后一条消息：首次为用户问题，重写后为改进的问题。
+        
+        Args:
+            state: 当前状态
+            
+        Returns:
+            包含工具调用消息的更新状态；需要由代理模型决策时返回 None
+        """
+        tool_name = self.direct_tool_name
+        if tool_name is None:
+            return None
+        
+        tool_call = {
+            "name": tool_name,
+            "args": {"query": state["messages"][-1].content},
+            "id": f"call_{uuid.uuid4().hex}",
+        }
+        return {"messages": [AIMessage(content="", tool_calls=[tool_call])]}
+    
+    @cached_property
+    def direct_tool_name(self) -> Optional[str]:
+        """可直接调用的唯一工具名（构建时确定一次）；需要代理模型决策时为 None"""
+        tools = self.get_tools()
+        if not self.config.SKIP_AGENT_DECISION or len(tools) != 1:
+            return None
+        return tools[0].name
+    
+    @cached_property
+    def agent_model(self):
+        """绑定了工具的代理模型（首次访问时创建，之后复用）"""
+        model = _chat_model(
             temperature=self.config.DEFAULT_TEMPERATURE,
             streaming=self.config.STREAMING,
             model=self.config.AGENT_MODEL  # 使用 gpt-5-mini
         )
-        model = model.bind_tools(self.get_tools())
-        
-        # 调用模型
-        response = model.invoke(messages)
-        
-        # 返回更新后的消息列表
-        return {"messages": [response]}
+        return model.bind_tools(self.get_tools())
     
     def grade_documents(self, state) -> Literal["generate", "rewrite"]:
         """
@@ -67,18 +197,47 @@ class AgentNodes:
         Returns:
             str: 决策结果 ("generate" 或 "rewrite")
         """
-        print("---检查文档相关性---")
+        logger.debug("---检查文档相关性---")
+        question, docs = self._grade_inputs(state)
         
+        # 执行评估
+        if self.config.GRADER_BACKEND == "embedding":
+            score = self._embedding_grade(question, docs)
+        else:
+            score = self._parse_grade(
+                self.grader_chain.invoke({"question": question, "context": docs})
+            )
+        return self._decide_from_grade(score)
+    
+    async def agrade_documents(self, state) -> Literal["generate", "rewrite"]:
+        """文档相关性评估节点（异步版本）"""
+        logger.debug("---检查文档相关性---")
+        question, docs = self._grade_inputs(state)
+        
+        if self.config.GRADER_BACKEND == "embedding":
+            score = await asyncio.to_thread(self._embedding_grade, question, docs)
+        else:
+            score = self._parse_grade(
+                await self.grader_chain.ainvoke({"question": question, "context": docs})
+            )
+        return self._decide_from_grade(score)
+    
+    @cached_property
+    def grader_chain(self):
+        """
+        文档相关性评估链（首次访问时创建，之后复用）
+        
+        使用小模型，并通过 logit_bias 与 max_tokens=1 强制只输出一个
+        "yes" 或 "no" token，不再需要结构化输出的函数调用开销。
+        """
         # 创建评分模型
-        model = ChatOpenAI(
+        model = _chat_model(
             temperature=self.config.DEFAULT_TEMPERATURE,
-            model=self.config.GRADER_MODEL,  # 使用 gpt-5
-            streaming=self.config.STREAMING
+            model=self.config.GRADER_MODEL,
+            max_tokens=1,
+            logit_bias=self._yes_no_logit_bias(),
         )
         
-        # 绑定结构化输出
-        llm_with_tool = model.with_structured_output(Grade)
-        
         # 创建评估提示
         prompt = PromptTemplate(
             template="""你是一个评估检索文档与用户问题相关性的评分员。
@@ -89,30 +248,61 @@ class AgentNodes:
             以下是用户问题: {question} 
             
             如果文档包含与用户问题相关的关键词或语义信息，则评定为相关。
-            请给出二元评分 'yes' 或 'no' 来表示文档是否与问题相关。""",
+            只回答 yes 或 no 来表示文档是否与问题相关。""",
             input_variables=["context", "question"],
         )
         
         # 创建评估链
-        chain = prompt | llm_with_tool
-        
-        # 获取问题和文档
-        messages = state["messages"]
-        last_message = messages[-1]
-        
-        question = messages[0].content
-        docs = last_message.content
+        return prompt | model | StrOutputParser()
+    
+    def _yes_no_logit_bias(self) -> Dict[str, int]:
+        """计算评分模型分词器中 "yes" 和 "no" 对应 token 的 logit_bias"""
+        import tiktoken
         
-        # 执行评估
-        scored_result = chain.invoke({"question": question, "context": docs})
-        score = scored_result.binary_score
+        try:
+            encoding = tiktoken.encoding_for_model(self.config.GRADER_MODEL)
+        except KeyError:
+            encoding = tiktoken.get_encoding("o200k_base")
+        return {str(encoding.encode(word)[0]): 100 for word in ("yes", "no")}
+    
+    @staticmethod
+    def _parse_grade(text: str) -> str:
+        """将评分模型的单 token 输出规范化为 'yes' 或 'no'"""
+        return "yes" if text.strip().lower().startswith("yes") else "no"
+    
+    def _embedding_grade(self, question: str, docs: str) -> str:
+        """
+        基于嵌入相似度的本地评分，不调用 LLM
         
+        Args:
+            question: 用户问题
+            docs: 检索到的文档文本
+            
+        Returns:
+            余弦相似度达到 GRADER_SIMILARITY_THRESHOLD 时返回 'yes'，否则 'no'
+        """
+        embeddings = vector_store_manager.embeddings
+        q = np.asarray(embeddings.embed_query(question), dtype=np.float32)
+        d = np.asarray(embeddings.embed_documents([docs])[0], dtype=np.float32)
+        norm = float(np.linalg.norm(q) * np.linalg.norm(d))
+        similarity = float(q @ d) / norm if norm else 0.0
+        return "yes" if similarity >= self.config.GRADER_SIMILARITY_THRESHOLD else "no"
+    
+    @staticmethod
+    def _grade_inputs(state):
+        """从状态中取出原始问题和最近一次检索到的文档（截断到评分上限）"""
+        messages = state["messages"]
+        return messages[0].content, messages[-1].content[:config.GRADER_MAX_CONTEXT_CHARS]
+    
+    @staticmethod
+    def _decide_from_grade(score: str) -> Literal["generate", "rewrite"]:
+        """根据评分结果决定下一步"""
         if score == "yes":
-            print("---决策：文档相关---")
+            logger.debug("---决策：文档相关---")
             return "generate"
         else:
-            print("---决策：文档不相关---")
-            print(f"评分: {score}")
+            logger.debug("---决策：文档不相关---")
+            logger.debug("评分: %s", score)
             return "rewrite"
     
     def rewrite(self, state):
@@ -125,12 +315,34 @@ class AgentNodes:
         Returns:
             dict: 包含重写后问题的更新状态
         """
-        print("---重写查询---")
-        messages = state["messages"]
-        question = messages[0].content
+        logger.debug("---重写查询---")
+        
+        # 执行重写
+        response = self.rewriter_model.invoke(self._rewrite_messages(state))
+        return {"messages": [response]}
+    
+    async def arewrite(self, state):
+        """查询重写节点（异步版本）"""
+        logger.debug("---重写查询---")
+        response = await self.rewriter_model.ainvoke(self._rewrite_messages(state))
+        return {"messages": [response]}
+    
+    @cached_property
+    def rewriter_model(self):
+        """查询重写模型（首次访问时创建，之后复用）"""
+        return _chat_model(
+            temperature=self.config.DEFAULT_TEMPERATURE,
+            model=self.config.REWRITER_MODEL,  # 使用 gpt-5
+            streaming=self.config.STREAMING
+        )
+    
+    @staticmethod
+    def _rewrite_messages(state):
+        """构建查询重写的提示消息"""
+        question = state["messages"][0].content
         
         # 创建重写消息
-        msg = [
+        return [
             HumanMessage(
                 content=f"""
                 请分析输入内容并尝试理解其潜在的语义意图和含义。
@@ -144,17 +356,6 @@ class AgentNodes:
                 """,
             )
         ]
-        
-        # 创建重写模型
-        model = ChatOpenAI(
-            temperature=self.config.DEFAULT_TEMPERATURE,
-            model=self.config.REWRITER_MODEL,  # 使用 gpt-5
-            streaming=self.config.STREAMING
-        )
-        
-        # 执行重写
-        response = model.invoke(msg)
-        return {"messages": [response]}
     
     def generate(self, state):
         """
@@ -166,29 +367,86 @@ class AgentNodes:
         Returns:
             dict: 包含生成答案的更新状态
         """
-        print("---生成答案---")
+        logger.debug("---生成答案---")
         messages = state["messages"]
         question = messages[0].content
         last_message = messages[-1]
         
         docs = last_message.content
         
-        # 从 hub 拉取 RAG 提示模板
-        prompt = hub.pull(self.config.RAG_PROMPT_HUB)
+        # 使用缓存的 RAG 链生成答案
+        response = self.rag_chain.invoke({"context": docs, "question": question})
+        return {"messages": [response]}
+    
+    async def agenerate(self, state):
+        """答案生成节点（异步版本）"""
+        logger.debug("---生成答案---")
+        messages = state["messages"]
+        question = messages[0].content
+        docs = messages[-1].content
         
-        # 创建生成模型
-        llm = ChatOpenAI(
-            model_name=self.config.GENERATOR_MODEL,  # 使用 gpt-5
+        response = await self.rag_chain.ainvoke({"context": docs, "question": question})
+        return {"messages": [response]}
+
+    
+    @cached_property
+    def grade_and_generate_chain(self):
+        """
+        评估与生成合并链（首次访问时创建，之后复用）
+        
+        一次调用同时判断文档相关性并给出答案，
+        相关时省去单独的评分调用。
+        """
+        model = _chat_model(
+            model_name=self.config.GENERATOR_MODEL,
             temperature=self.config.DEFAULT_TEMPERATURE,
-            streaming=self.config.STREAMING
+            streaming=True,
         )
+        prompt = ChatPromptTemplate.from_messages([
+            ("system", """你是一个问答助手。首先判断检索到的文档是否与用户问题相关：
+            如果文档包含与问题相关的关键词或语义信息，则 relevant 为 true，
+            并且只基于这些文档回答问题；不知道答案就直接说不知道。答案最多三句话，保持简洁。
+            如果文档不相关，relevant 为 false，answer 留空。"""),
+            ("human", "问题: {question}\n\n检索到的文档:\n{context}"),
+        ])
+        return prompt | model.with_structured_output(GradedAnswer)
+    
+    def grade_and_generate(self, state):
+        """
+        评估并生成节点：文档相关时直接给出答案
         
-        # 创建 RAG 链
-        rag_chain = prompt | llm | StrOutputParser()
+        Args:
+            state: 当前状态
+            
+        Returns:
+            dict: 相关性结果，以及（相关时）生成的答案
+        """
+        logger.debug("---检查文档相关性并生成答案---")
+        question, docs = self._grade_inputs(state)
+        result = self.grade_and_generate_chain.invoke({"question": question, "context": docs})
+        return self._graded_answer_update(result)
+    
+    async def agrade_and_generate(self, state):
+        """评估并生成节点（异步版本）"""
+        logger.debug("---检查文档相关性并生成答案---")
+        question, docs = self._grade_inputs(state)
+        result = await self.grade_and_generate_chain.ainvoke({"question": question, "context": docs})
+        return self._graded_answer_update(result)
+    
+    @staticmethod
+    def _graded_answer_update(result: GradedAnswer):
+        """将合并输出转换为状态更新"""
+        if result.relevant and result.answer:
+            logger.debug("---决策：文档相关---")
+            return {"messages": [result.answer], "documents_relevant": True}
         
-        # 生成答案
-        response = rag_chain.invoke({"context": docs, "question": question})
-        return {"messages": [response]}
+        logger.debug("---决策：文档不相关---")
+        return {"documents_relevant": False}
+    
+    @staticmethod
+    def route_after_grade_and_generate(state) -> Literal["end", "rewrite"]:
+        """根据合并节点的相关性结果决定结束还是重写查询"""
+        return "end" if state.get("documents_relevant") else "rewrite"
 
 
 # 创建全局节点实例
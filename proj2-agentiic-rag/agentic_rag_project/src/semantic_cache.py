@@ -0,0 +1,86 @@
+"""语义缓存模块 - 对语义相近的问题直接复用已生成的答案"""
+
+import hashlib
+import logging
+import time
+import uuid
+from typing import Dict, Optional, Tuple
+from langchain_community.vectorstores import Chroma
+from langchain_core.embeddings import Embeddings
+from .config import config
+from .text_norm import normalize, question_key
+
+logger = logging.getLogger("agentic_rag")
+
+
+class SemanticCache:
+    """基于问题嵌入的答案缓存"""
+    
+    def __init__(self, embeddings: Embeddings):
+        """
+        初始化语义缓存
+        
+        Args:
+            embeddings: 用于嵌入问题的模型（与向量存储共用）
+        """
+        self.config = config
+        
+        # 按知识库集合名划分命名空间，不同知识库的答案互不混用
+        namespace = hashlib.sha256(self.config.COLLECTION_NAME.encode()).hexdigest()[:8]
+        self.store = Chroma(
+            collection_name=f"{self.config.SEMANTIC_CACHE_COLLECTION}-{namespace}",
+            embedding_function=embeddings,
+            collection_metadata={"hnsw:space": "cosine"},
+        )
+        # 第一层：规范化问题哈希 -> (答案, 写入时间)，完全相同的问题无需嵌入
+        self._exact: Dict[str, Tuple[str, float]] = {}
+    
+    def lookup(self, question: str) -> Optional[str]:
+        """
+        查找语义相近问题的缓存答案
+        
+        Args:
+            question: 用户问题
+        
+        Returns:
+            缓存的答案；未命中、已过期时返回 None
+        """
+        min_ts = time.time() - self.config.SEMANTIC_CACHE_TTL
+        
+        exact = self._exact.get(question_key(question))
+        if exact is not None and exact[1] >= min_ts:
+            logger.info("⚡ 语义缓存精确命中: %s", question)
+            return exact[0]
+        
+        if self.store._collection.count() == 0:
+            return None
+        
+        # 只在未过期的条目中查找
+        matches = self.store.similarity_search_with_score(
+            normalize(question), k=1, filter={"ts": {"$gte": min_ts}}
+        )
+        if not matches:
+            return None
+        
+        doc, distance = matches[0]
+        if distance > self.config.SEMANTIC_CACHE_MAX_DISTANCE:
+            return None
+        
+        logger.info("⚡ 语义缓存命中 (余弦距离 %.3f): %s", distance, doc.page_content)
+        return doc.metadata["answer"]
+    
+    def insert(self, question: str, answer: str) -> None:
+        """
+        缓存问题和答案
+        
+        Args:
+            question: 用户问题
+            answer: 生成的答案
+        """
+        ts = time.time()
+        self._exact[question_key(question)] = (answer, ts)
+        self.store.add_texts(
+            [normalize(question)],
+            metadatas=[{"answer": answer, "ts": ts}],
+            ids=[str(uuid.uuid4())],
+        )
@@ -0,0 +1,41 @@
+"""文本规范化模块 - 统一问题字符串，供缓存和嵌入查找使用"""
+
+import hashlib
+import unicodedata
+
+try:
+    import xxhash
+except ImportError:  # 可选依赖，未安装时使用标准库哈希
+    xxhash = None
+
+
+def normalize(q: str) -> str:
+    """
+    规范化问题文本
+
+    NFKC 统一全角/半角等等价字符，合并连续空白，并转为小写，
+    只有空白或大小写不同的问题得到相同的结果。
+
+    Args:
+        q: 原始问题
+
+    Returns:
+        规范化后的问题
+    """
+    return " ".join(unicodedata.normalize("NFKC", q).split()).lower()
+
+
+def question_key(q: str) -> str:
+    """
+    计算问题的精确匹配键
+
+    Args:
+        q: 问题（内部会先规范化）
+
+    Returns:
+        规范化问题的 64 位十六进制哈希
+    """
+    data = normalize(q).encode("utf-8")
+    if xxhash is not None:
+        return xxhash.xxh3_64_hexdigest(data)
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
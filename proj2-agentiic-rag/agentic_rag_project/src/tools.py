@@ -1,12 +1,15 @@
 """工具定义模块 - 定义 Agent 可使用的工具"""
 ## 只定义和注册了一种工具
 
+import logging
 from typing import List
 from langchain.tools.retriever import create_retriever_tool
 from langchain_core.tools import Tool
 from .vector_store import vector_store_manager
 from .config import config
 
+logger = logging.getLogger("agentic_rag")
+
 
 class ToolsManager:
     """工具管理器类"""
@@ -27,7 +30,7 @@ class ToolsManager:
         if vector_store_manager.retriever is None:
             raise ValueError("检索器尚未初始化，请先调用 vector_store_manager.initialize()")
         
-        print(f"正在创建检索工具: {self.config.RETRIEVER_TOOL_NAME}")
+        logger.info("正在创建检索工具: %s", self.config.RETRIEVER_TOOL_NAME)
         
         self.retriever_tool = create_retriever_tool(
             vector_store_manager.retriever,
@@ -35,7 +38,7 @@ class ToolsManager:
             self.config.RETRIEVER_TOOL_DESC,
         )
         
-        print("检索工具创建成功")
+        logger.info("检索工具创建成功")
         return self.retriever_tool
     
     def get_tools(self) -> List[Tool]:
@@ -50,9 +53,9 @@ class ToolsManager:
             retriever_tool = self.create_retriever_tool()
             self.tools = [retriever_tool]
             
-            print(f"已注册 {len(self.tools)} 个工具:")
+            logger.info("已注册 %d 个工具:", len(self.tools))
             for i, tool in enumerate(self.tools, 1):
-                print(f"  {i}. {tool.name}: {tool.description}")
+                logger.info("  %d. %s: %s", i, tool.name, tool.description)
         
         return self.tools
     
@@ -63,9 +66,9 @@ class ToolsManager:
         Returns:
             初始化后的工具列表
         """
-        print("=== 初始化工具 ===")
+        logger.info("=== 初始化工具 ===")
         tools = self.get_tools()
-        print("=== 工具初始化完成 ===\n")
+        logger.info("=== 工具初始化完成 ===")
         return tools
 
 
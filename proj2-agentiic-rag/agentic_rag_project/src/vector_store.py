@@ -1,13 +1,136 @@
 """向量存储和检索模块 - 处理文档索引和检索"""
 
-from typing import List
+import hashlib
+import json
+import logging
+import os
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, List
 from langchain_community.document_loaders import WebBaseLoader
 from langchain_community.vectorstores import Chroma
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
 from langchain_openai import OpenAIEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_text_splitters import TokenTextSplitter
 from langchain.schema import Document
 from .config import config
 
+logger = logging.getLogger("agentic_rag")
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """对查询向量做 L2 归一化和进程内 LRU 缓存的嵌入模型包装"""
+    
+    def __init__(self, inner: Embeddings, maxsize: int):
+        """
+        初始化包装器
+        
+        Args:
+            inner: 实际计算嵌入的模型
+            maxsize: 缓存的查询数量上限
+        """
+        self.inner = inner
+        self.model_name = getattr(inner, "model", type(inner).__name__)
+        self._embed_query_cached = lru_cache(maxsize=maxsize)(self._embed_query_uncached)
+    
+    def _embed_query_uncached(self, model_name: str, text: str) -> tuple:
+        import numpy as np
+        
+        # 查询向量做 L2 归一化，与 FAISS 内积索引中的文档向量保持一致（余弦相似度不受影响）
+        vector = np.asarray(self.inner.embed_query(text), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return tuple((vector / norm if norm else vector).tolist())
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.inner.embed_documents(texts)
+    
+    def embed_query(self, text: str) -> List[float]:
+        # 以 (模型名, 合并空白后的文本) 为键，重写循环中的重复查询不再调用嵌入 API；
+        # 只合并空白，不改大小写，嵌入的仍是用户原文
+        normalized = " ".join(text.split())
+        return list(self._embed_query_cached(self.model_name, normalized))
+
+
+class NumpyRetriever(BaseRetriever):
+    """
+    基于 NumPy 的精确余弦检索器
+    
+    所有文档向量预先 L2 归一化并保存在一个 (N, d) FP32 矩阵中，
+    每次查询只需一次矩阵-向量乘法，无需额外的原生依赖。
+    """
+    
+    matrix: Any
+    docs: List[Document]
+    embeddings: Embeddings
+    k: int = 4
+    
+    class Config:
+        arbitrary_types_allowed = True
+    
+    @classmethod
+    def from_embeddings(cls, vectors: List[List[float]], docs: List[Document], embeddings: Embeddings, **kwargs):
+        """
+        由预先计算的向量构建检索器
+        
+        Args:
+            vectors: 文档向量
+            docs: 与向量一一对应的文档
+            embeddings: 用于嵌入查询的模型
+            
+        Returns:
+            检索器实例
+        """
+        import numpy as np
+        
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if matrix.size:
+            matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+        return cls(matrix=matrix, docs=docs, embeddings=embeddings, **kwargs)
+    
+    def save(self, index_dir: str) -> None:
+        """将向量矩阵和文档保存到目录"""
+        import numpy as np
+        
+        np.save(os.path.join(index_dir, "vectors.npy"), self.matrix)
+        with open(os.path.join(index_dir, "docs.json"), "w", encoding="utf-8") as f:
+            json.dump(
+                [{"page_content": d.page_content, "metadata": d.metadata} for d in self.docs],
+                f,
+                ensure_ascii=False,
+            )
+    
+    @classmethod
+    def load(cls, index_dir: str, embeddings: Embeddings, **kwargs):
+        """从目录加载 save() 保存的检索器"""
+        import numpy as np
+        
+        matrix = np.load(os.path.join(index_dir, "vectors.npy"))
+        with open(os.path.join(index_dir, "docs.json"), encoding="utf-8") as f:
+            docs = [Document(**d) for d in json.load(f)]
+        return cls(matrix=matrix, docs=docs, embeddings=embeddings, **kwargs)
+    
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        import numpy as np
+        
+        k = min(self.k, len(self.docs))
+        if k == 0:
+            return []
+        
+        q = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        q /= np.linalg.norm(q)
+        scores = self.matrix @ q
+        
+        # 先用 argpartition 取出前 k 个，再只对这 k 个排序
+        idx = np.argpartition(scores, -k)[-k:]
+        idx = idx[np.argsort(-scores[idx])]
+        return [self.docs[i] for i in idx]
+
 
 class VectorStoreManager:
     """管理向量存储和检索的类"""
@@ -17,7 +140,16 @@ class VectorStoreManager:
         self.config = config
         self.vectorstore = None
         self.retriever = None
-        self.embeddings = OpenAIEmbeddings()
+        # 显式指定批大小：建索引时每个请求携带多条文本，摊薄 HTTP 往返开销
+        # 查询向量经过 LRU 缓存
+        self.embeddings = CachedQueryEmbeddings(
+            OpenAIEmbeddings(
+                chunk_size=self.config.EMBEDDING_BATCH_SIZE,
+                max_retries=5,
+                request_timeout=60,
+            ),
+            maxsize=self.config.QUERY_EMBEDDING_CACHE_SIZE,
+        )
     
     def load_documents(self, urls: List[str] = None) -> List[Document]:
         """
@@ -32,14 +164,19 @@ class VectorStoreManager:
         if urls is None:
             urls = self.config.BLOG_URLS
         
-        print(f"正在从 {len(urls)} 个 URL 加载文档...")
-        docs = []
+        logger.info("正在从 %d 个 URL 加载文档...", len(urls))
         for url in urls:
-            print(f"  - 加载: {url}")
-            loader = WebBaseLoader(url)
-            docs.extend(loader.load())
+            logger.info("  - 加载: %s", url)
+        
+        # 各 URL 互不依赖，并发下载；单个站点失败时跳过，不影响其他 URL
+        def load(url: str) -> List[Document]:
+            loader = WebBaseLoader(url, continue_on_failure=True)
+            return loader.load()
         
-        print(f"成功加载 {len(docs)} 个文档")
+        with ThreadPoolExecutor(max_workers=min(32, len(urls) or 1)) as executor:
+            docs = [doc for url_docs in executor.map(load, urls) for doc in url_docs]
+        
+        logger.info("成功加载 %d 个文档", len(docs))
         return docs
     
     def split_documents(self, documents: List[Document]) -> List[Document]:
@@ -52,39 +189,226 @@ class VectorStoreManager:
         Returns:
             分割后的文档块列表
         """
-        print(f"正在分割文档 (chunk_size={self.config.CHUNK_SIZE}, overlap={self.config.CHUNK_OVERLAP})...")
+        logger.info(
+            "正在分割文档 (chunk_size=%d, overlap=%d)...",
+            self.config.CHUNK_SIZE, self.config.CHUNK_OVERLAP
+        )
         
-        text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        # 每个文档只编码一次，按 token 窗口切片后再解码，
+        # 避免递归分割时对候选片段反复调用 tiktoken
+        text_splitter = TokenTextSplitter(
+            encoding_name=self.config.TOKEN_ENCODING,
             chunk_size=self.config.CHUNK_SIZE,
             chunk_overlap=self.config.CHUNK_OVERLAP
         )
         
         doc_splits = text_splitter.split_documents(documents)
-        print(f"文档已分割成 {len(doc_splits)} 个块")
+        logger.info("文档已分割成 %d 个块", len(doc_splits))
         
         return doc_splits
     
-    def create_vectorstore(self, documents: List[Document]) -> Chroma:
+    def _index_dir(self) -> str:
+        """当前后端和集合对应的索引保存目录"""
+        return os.path.join(
+            self.config.VECTOR_STORE_DIR,
+            f"{self.config.VECTOR_STORE_BACKEND}-{self.config.COLLECTION_NAME}"
+        )
+    
+    def _manifest_hash(self) -> str:
+        """
+        计算索引清单的哈希
+        
+        文档源和分块参数任一变化时哈希随之变化，已保存的索引随即失效。
+        """
+        manifest = {
+            "urls": self.config.BLOG_URLS,
+            "chunk_size": self.config.CHUNK_SIZE,
+            "chunk_overlap": self.config.CHUNK_OVERLAP,
+            "token_encoding": self.config.TOKEN_ENCODING,
+            "metric": "normalized-ip",
+            "index_factory": self.config.FAISS_INDEX_FACTORY,
+        }
+        return hashlib.sha256(json.dumps(manifest, sort_keys=True).encode()).hexdigest()
+    
+    def _manifest_path(self) -> str:
+        return os.path.join(self._index_dir(), "manifest.json")
+    
+    def _has_valid_index(self) -> bool:
+        """已保存的索引是否存在且与当前配置一致"""
+        try:
+            with open(self._manifest_path(), encoding="utf-8") as f:
+                return json.load(f).get("hash") == self._manifest_hash()
+        except (OSError, ValueError):
+            return False
+    
+    def _write_manifest(self) -> None:
+        with open(self._manifest_path(), "w", encoding="utf-8") as f:
+            json.dump({"hash": self._manifest_hash()}, f)
+    
+    @staticmethod
+    def _faiss_kwargs() -> dict:
+        """
+        FAISS 的度量参数（创建和加载时必须一致）
+        
+        文档向量在写入前、查询向量在 CachedQueryEmbeddings 中已做 L2 归一化，
+        余弦相似度退化为一次内积；不再传 normalize_L2，避免 LangChain 对
+        该参数与 MAX_INNER_PRODUCT 组合发出警告。
+        """
+        from langchain_community.vectorstores.utils import DistanceStrategy
+        
+        return {"distance_strategy": DistanceStrategy.MAX_INNER_PRODUCT}
+    
+    def _tune_faiss_index(self, index) -> None:
+        """设置 IVF 探测数和 RFlat 重排系数（这些搜索参数不一定随索引文件保存）"""
+        import faiss
+        
+        try:
+            faiss.extract_index_ivf(index).nprobe = self.config.FAISS_NPROBE
+        except RuntimeError:
+            pass  # 非 IVF 索引
+        if isinstance(index, faiss.IndexRefine):
+            index.k_factor = self.config.FAISS_REFINE_K_FACTOR
+    
+    def _build_faiss(self, texts: List[str], vectors: List[List[float]], metadatas: List[dict]):
+        """
+        按 FAISS_INDEX_FACTORY 构建 FAISS 向量存储
+        
+        "Flat" 直接使用 IndexFlatIP；其他描述串（如 IVF-PQ、SQ 量化）先在
+        归一化后的向量上训练再写入。文档太少无法训练时退回精确索引。
+        
+        Args:
+            texts: 文档块文本
+            vectors: 对应的嵌入向量
+            metadatas: 对应的元数据
+            
+        Returns:
+            FAISS 向量存储实例
+        """
+        import faiss
+        import numpy as np
+        from langchain_community.docstore.in_memory import InMemoryDocstore
+        from langchain_community.vectorstores import FAISS
+        
+        matrix = np.asarray(vectors, dtype=np.float32)
+        faiss.normalize_L2(matrix)
+        text_embeddings = list(zip(texts, matrix.tolist()))
+        spec = self.config.FAISS_INDEX_FACTORY
+        if spec != "Flat":
+            index = faiss.index_factory(matrix.shape[1], spec, faiss.METRIC_INNER_PRODUCT)
+            try:
+                index.train(matrix)
+            except RuntimeError as e:
+                logger.warning("索引 %s 训练失败（%d 个向量），改用精确索引: %s", spec, len(texts), e)
+            else:
+                self._tune_faiss_index(index)
+                store = FAISS(
+                    embedding_function=self.embeddings,
+                    index=index,
+                    docstore=InMemoryDocstore(),
+                    index_to_docstore_id={},
+                    **self._faiss_kwargs(),
+                )
+                store.add_embeddings(text_embeddings, metadatas=metadatas)
+                return store
+        
+        return FAISS.from_embeddings(
+            text_embeddings=text_embeddings,
+            embedding=self.embeddings,
+            metadatas=metadatas,
+            **self._faiss_kwargs(),
+        )
+    
+    def create_vectorstore(self, documents: List[Document]):
         """
         创建向量存储
         
+        后端由 config.VECTOR_STORE_BACKEND 决定：
+        "faiss"（默认）将归一化后的 FP32 向量存入内积索引，并保存到本地；
+        "chroma" 使用 Chroma 集合；
+        "numpy" 使用 NumpyRetriever，在内存矩阵上做精确余弦检索。
+        
         Args:
             documents: 要索引的文档列表
             
         Returns:
             创建的向量存储实例
         """
-        print(f"正在创建向量存储 (collection={self.config.COLLECTION_NAME})...")
+        backend = self.config.VECTOR_STORE_BACKEND
+        logger.info("正在创建向量存储 (backend=%s, collection=%s)...", backend, self.config.COLLECTION_NAME)
         
-        self.vectorstore = Chroma.from_documents(
-            documents=documents,
-            collection_name=self.config.COLLECTION_NAME,
-            embedding=self.embeddings,
-        )
+        if backend not in ("faiss", "chroma", "numpy"):
+            raise ValueError(f"不支持的向量存储后端: {backend}")
+        
+        # 清除过期的索引，避免新文档追加到旧集合中
+        index_dir = self._index_dir()
+        shutil.rmtree(index_dir, ignore_errors=True)
+        os.makedirs(index_dir, exist_ok=True)
         
-        print("向量存储创建成功")
+        # 预先批量计算所有文档块的向量，再交给向量存储
+        texts = [doc.page_content for doc in documents]
+        metadatas = [doc.metadata for doc in documents]
+        vectors = self.embeddings.embed_documents(texts)
+        
+        if backend == "faiss":
+            self.vectorstore = self._build_faiss(texts, vectors, metadatas)
+            self.vectorstore.save_local(index_dir)
+        elif backend == "numpy":
+            self.vectorstore = NumpyRetriever.from_embeddings(vectors, documents, self.embeddings)
+            self.vectorstore.save(index_dir)
+        else:
+            # chromadb >= 0.4 在写入时自动持久化
+            self.vectorstore = Chroma(
+                collection_name=self.config.COLLECTION_NAME,
+                embedding_function=self.embeddings,
+                persist_directory=index_dir,
+            )
+            self.vectorstore._collection.add(
+                ids=[str(uuid.uuid4()) for _ in documents],
+                embeddings=vectors,
+                documents=texts,
+                metadatas=metadatas,
+            )
+        
+        self._write_manifest()
+        logger.info("向量存储创建成功")
         return self.vectorstore
     
+    def load_vectorstore(self) -> bool:
+        """
+        加载已保存的向量存储
+        
+        只有清单哈希与当前文档源和分块参数一致时才复用。
+        
+        Returns:
+            是否成功加载（没有可用的已保存索引时返回 False）
+        """
+        if not self._has_valid_index():
+            return False
+        
+        index_dir = self._index_dir()
+        logger.info("正在加载已保存的索引: %s", index_dir)
+        
+        if self.config.VECTOR_STORE_BACKEND == "faiss":
+            from langchain_community.vectorstores import FAISS
+            
+            # 索引文件由本程序生成，可以安全反序列化
+            self.vectorstore = FAISS.load_local(
+                index_dir,
+                self.embeddings,
+                allow_dangerous_deserialization=True,
+                **self._faiss_kwargs(),
+            )
+            self._tune_faiss_index(self.vectorstore.index)
+        elif self.config.VECTOR_STORE_BACKEND == "numpy":
+            self.vectorstore = NumpyRetriever.load(index_dir, self.embeddings)
+        else:
+            self.vectorstore = Chroma(
+                collection_name=self.config.COLLECTION_NAME,
+                embedding_function=self.embeddings,
+                persist_directory=index_dir,
+            )
+        return True
+    
     def get_retriever(self):
         """
         获取检索器
@@ -96,8 +420,12 @@ class VectorStoreManager:
             raise ValueError("向量存储尚未创建，请先调用 create_vectorstore()")
         
         if self.retriever is None:
-            self.retriever = self.vectorstore.as_retriever()
-            print("检索器已创建")
+            if isinstance(self.vectorstore, NumpyRetriever):
+                # numpy 后端本身就是检索器
+                self.retriever = self.vectorstore
+            else:
+                self.retriever = self.vectorstore.as_retriever()
+            logger.info("检索器已创建")
         
         return self.retriever
     
@@ -105,21 +433,23 @@ class VectorStoreManager:
         """
         完整的初始化流程：加载、分割、索引文档
         """
-        print("=== 初始化向量存储 ===")
-        
-        # 1. 加载文档
-        documents = self.load_documents()
-        
-        # 2. 分割文档
-        doc_splits = self.split_documents(documents)
+        logger.info("=== 初始化向量存储 ===")
         
-        # 3. 创建向量存储
-        self.create_vectorstore(doc_splits)
+        # 已有保存的索引时直接加载，无需重新下载和嵌入
+        if not self.load_vectorstore():
+            # 1. 加载文档
+            documents = self.load_documents()
+            
+            # 2. 分割文档
+            doc_splits = self.split_documents(documents)
+            
+            # 3. 创建向量存储
+            self.create_vectorstore(doc_splits)
         
         # 4. 创建检索器
         self.get_retriever()
         
-        print("=== 向量存储初始化完成 ===\n")
+        logger.info("=== 向量存储初始化完成 ===")
     
     def search(self, query: str, k: int = 4) -> List[Document]:
         """
@@ -1,19 +1,25 @@
 """工作流构建模块 - 定义和构建 LangGraph 工作流"""
 
+import logging
 from typing import Annotated, Sequence, TypedDict
 from langchain_core.messages import BaseMessage
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import END, StateGraph, START
 from langgraph.graph.message import add_messages
 from langgraph.prebuilt import ToolNode, tools_condition
 from .nodes import agent_nodes
 from .tools import tools_manager
 
+logger = logging.getLogger("agentic_rag")
+
 
 class AgentState(TypedDict):
     """代理状态定义"""
     # add_messages 函数定义如何处理更新
     # 默认是替换，add_messages 表示 "追加"
     messages: Annotated[Sequence[BaseMessage], add_messages]
+    # 合并评估与生成节点写入的文档相关性结果
+    documents_relevant: bool
 
 
 class WorkflowBuilder:
@@ -39,33 +45,42 @@ class WorkflowBuilder:
         Returns:
             构建的状态图
         """
-        print("=== 构建工作流 ===")
+        logger.info("=== 构建工作流 ===")
         
         # 创建状态图
         workflow = StateGraph(AgentState)
         
         # 添加节点
-        print("添加节点:")
-        workflow.add_node("agent", self.nodes.agent)
-        print("  - agent: 代理决策节点")
+        logger.info("添加节点:")
+        # 节点同时提供同步与异步实现，invoke/stream 与 ainvoke/astream 均可运行
+        workflow.add_node("agent", RunnableLambda(self.nodes.agent, afunc=self.nodes.aagent))
+        logger.info("  - agent: 代理决策节点（单工具时直接发起检索）")
         
         # 创建检索工具节点
         retrieve = ToolNode(self.get_tools())
         workflow.add_node("retrieve", retrieve)
-        print("  - retrieve: 文档检索节点")
-        
-        workflow.add_node("rewrite", self.nodes.rewrite)
-        print("  - rewrite: 查询重写节点")
-        
-        workflow.add_node("generate", self.nodes.generate)
-        print("  - generate: 答案生成节点")
+        logger.info("  - retrieve: 文档检索节点")
+        
+        workflow.add_node("rewrite", RunnableLambda(self.nodes.rewrite, afunc=self.nodes.arewrite))
+        logger.info("  - rewrite: 查询重写节点")
+        
+        fused = self.nodes.config.FUSE_GRADE_AND_GENERATE
+        if fused:
+            workflow.add_node(
+                "grade_and_generate",
+                RunnableLambda(self.nodes.grade_and_generate, afunc=self.nodes.agrade_and_generate)
+            )
+            logger.info("  - grade_and_generate: 文档评估 + 答案生成节点")
+        else:
+            workflow.add_node("generate", RunnableLambda(self.nodes.generate, afunc=self.nodes.agenerate))
+            logger.info("  - generate: 答案生成节点")
         
         # 添加边
-        print("添加边和条件边:")
+        logger.info("添加边和条件边:")
         
         # 从开始到代理节点
         workflow.add_edge(START, "agent")
-        print("  - START → agent")
+        logger.info("  - START → agent")
         
         # 代理节点的条件边：决定是否检索
         workflow.add_conditional_edges(
@@ -78,42 +93,66 @@ class WorkflowBuilder:
                 END: END,            # 如果不需要工具，则结束
             },
         )
-        print("  - agent → [条件] → retrieve/END")
-        
-        # 检索节点的条件边：评估文档相关性
-        workflow.add_conditional_edges(
-            "retrieve",
-            # 评估文档相关性
-            self.nodes.grade_documents,
-        )
-        print("  - retrieve → [文档评估] → generate/rewrite")
-        
-        # 生成节点到结束
-        workflow.add_edge("generate", END)
-        print("  - generate → END")
+        logger.info("  - agent → [条件] → retrieve/END")
+        
+        if fused:
+            # 检索后一次调用完成评估与生成，不相关时重写查询
+            workflow.add_edge("retrieve", "grade_and_generate")
+            workflow.add_conditional_edges(
+                "grade_and_generate",
+                self.nodes.route_after_grade_and_generate,
+                {
+                    "end": END,
+                    "rewrite": "rewrite",
+                },
+            )
+            logger.info("  - retrieve → grade_and_generate → [相关性] → END/rewrite")
+        else:
+            # 检索节点的条件边：评估文档相关性
+            workflow.add_conditional_edges(
+                "retrieve",
+                # 评估文档相关性
+                RunnableLambda(self.nodes.grade_documents, afunc=self.nodes.agrade_documents),
+                ["generate", "rewrite"],
+            )
+            logger.info("  - retrieve → [文档评估] → generate/rewrite")
+            
+            # 生成节点到结束
+            workflow.add_edge("generate", END)
+            logger.info("  - generate → END")
         
         # 重写节点回到代理节点
         workflow.add_edge("rewrite", "agent")
-        print("  - rewrite → agent")
+        logger.info("  - rewrite → agent")
         
         self.state_graph = workflow
-        print("=== 工作流构建完成 ===\n")
+        logger.info("=== 工作流构建完成 ===")
         
         return workflow
     
-    def compile_workflow(self) -> StateGraph:
+    def compile_workflow(self, checkpointer=None) -> StateGraph:
         """
         编译工作流
         
+        传入 checkpointer 时，每个节点完成后都会写入检查点，
+        运行中断后用同一 thread_id 再次查询即可从最后完成的节点恢复。
+        检查点的清理由调用方负责，因此默认关闭。
+        
+        Args:
+            checkpointer: 检查点存储（如 MemorySaver、SqliteSaver），默认不保存检查点
+        
         Returns:
             编译后的图
         """
         if self.state_graph is None:
             self.build_workflow()
         
-        print("=== 编译工作流 ===")
-        self.compiled_graph = self.state_graph.compile()
-        print("=== 工作流编译完成 ===\n")
+        logger.info("=== 编译工作流 ===")
+        # 构建时确定是否可以跳过代理决策，运行时不再查询工具列表
+        if self.nodes.direct_tool_name:
+            logger.info("单工具模式: agent 直接调用 %s", self.nodes.direct_tool_name)
+        self.compiled_graph = self.state_graph.compile(checkpointer=checkpointer)
+        logger.info("=== 工作流编译完成 ===")
         
         return self.compiled_graph
     
@@ -148,29 +187,32 @@ class WorkflowBuilder:
             if save_path:
                 with open(save_path, 'wb') as f:
                     f.write(graph_image)
-                print(f"工作流图已保存到: {save_path}")
+                logger.info("工作流图已保存到: %s", save_path)
             
             # 在 Jupyter 中显示
             try:
                 display(Image(graph_image))
             except:
-                print("无法在当前环境中显示图像")
+                logger.warning("无法在当前环境中显示图像")
                 
         except ImportError:
-            print("可视化需要额外的依赖包，跳过图像生成")
+            logger.warning("可视化需要额外的依赖包，跳过图像生成")
         except Exception as e:
-            print(f"生成可视化图像时出错: {e}")
+            logger.warning("生成可视化图像时出错: %s", e)
     
-    def initialize(self):
+    def initialize(self, checkpointer=None):
         """
         完整初始化工作流
         
+        Args:
+            checkpointer: 检查点存储，默认不保存检查点
+        
         Returns:
             编译后的图
         """
-        print("=== 初始化工作流 ===")
-        graph = self.compile_workflow()
-        print("=== 工作流初始化完成 ===\n")
+        logger.info("=== 初始化工作流 ===")
+        graph = self.compile_workflow(checkpointer)
+        logger.info("=== 工作流初始化完成 ===")
         return graph
 
 